@@ -0,0 +1,89 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from lib.codec import json_codec
+from lib.kafka_connect import KafkaMessage
+from lib.metrics import processor_metrics
+
+
+class FakeKafkaConsumer:
+    """
+    KafkaConsumer поверх списка закодированных сообщений (bytes, как value в Kafka).
+    Одна партиция, оффсет - номер сообщения в списке; сообщения декодируются
+    в consume_batch, как у настоящего консьюмера.
+    """
+
+    def __init__(self, values: List[bytes], topic: str = 'replay') -> None:
+        self.topic = topic
+        self._values = values
+        self._position = 0
+        self.committed = 0
+
+    def consume_batch(self, num_messages: int = 100, timeout: float = 3.0) -> List[KafkaMessage]:
+        with processor_metrics.stage('kafka_poll'):
+            values = self._values[self._position:self._position + num_messages]
+        with processor_metrics.stage('kafka_decode'):
+            batch = [
+                KafkaMessage(self.topic, 0, self._position + i, json_codec.loads(value))
+                for i, value in enumerate(values)
+            ]
+        self._position += len(batch)
+        return batch
+
+    def commit(self, messages: List[KafkaMessage], asynchronous: bool = True) -> None:
+        if messages:
+            self.committed = max(self.committed, messages[-1].offset + 1)
+
+    def rewind(self, messages: List[KafkaMessage]) -> None:
+        if messages:
+            self._position = min(self._position, messages[0].offset)
+
+    def lag(self, timeout: float = 5.0) -> Dict[int, int]:
+        return {0: len(self._values) - self.committed}
+
+    def close(self) -> None:
+        pass
+
+
+class FakeKafkaProducer:
+    """KafkaProducer, который копит закодированные сообщения в памяти (доставка - мгновенная)"""
+
+    def __init__(self) -> None:
+        self.values: List[bytes] = []
+        self.keys: List[Optional[str]] = []
+
+    def produce(self, payload: Dict, key: Optional[str] = None) -> None:
+        self.values.append(json_codec.dumps(payload))
+        self.keys.append(key)
+
+    def flush(self, timeout: float = 10) -> None:
+        pass
+
+
+class FakeRedisClient:
+    """
+    RedisClient над словарём документов. Документы хранятся в json, как в Redis,
+    и разбираются при каждом чтении; calls - сколько было обращений (round-trip-ов) к "Redis".
+    """
+
+    def __init__(self, docs: Dict[Any, Dict]) -> None:
+        self._docs = {k: json_codec.dumps(v) for k, v in docs.items()}
+        self.calls = 0
+
+    def set(self, k, v) -> None:
+        self.calls += 1
+        self._docs[k] = json_codec.dumps(v)
+
+    def get(self, k) -> Optional[Dict]:
+        self.calls += 1
+        obj = self._docs.get(k)
+        return None if obj is None else json_codec.loads(obj)
+
+    def mget(self, keys: Iterable) -> Dict[Any, Optional[Dict]]:
+        unique_keys = list(dict.fromkeys(keys))
+        if not unique_keys:
+            return {}
+        self.calls += 1
+        return {
+            k: (None if self._docs.get(k) is None else json_codec.loads(self._docs[k]))
+            for k in unique_keys
+        }
@@ -0,0 +1,97 @@
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+
+def generate(
+            orders: int,
+            users: int = 200,
+            restaurants: int = 10,
+            menu_size: int = 40,
+            categories: int = 8,
+            max_items: int = 5,
+            seed: int = 1
+        ) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    поток заказов исходного топика STG-сервиса и документы Redis (пользователи и рестораны с меню).
+    Поток детерминирован по seed: одинаковые параметры - одинаковые заказы.
+    """
+    rnd = random.Random(seed)
+    update_ts = '2023-01-01 00:00:00'
+
+    redis_docs = {}
+    user_ids = []
+    for i in range(users):
+        user_id = f'u{i:022d}'
+        user_ids.append(user_id)
+        redis_docs[user_id] = {
+            '_id': user_id,
+            'name': f'Пользователь {i}',
+            'login': f'user_{i}',
+            'update_ts_utc': update_ts
+        }
+
+    menus = {}
+    for r in range(restaurants):
+        restaurant_id = f'r{r:022d}'
+        menu = [
+            {
+                '_id': f'p{r:03d}{i:019d}',
+                'name': f'Блюдо {i} ресторана {r}',
+                'price': 100 + 10 * rnd.randint(0, 80),
+                'category': f'Категория {rnd.randrange(categories)}'
+            }
+            for i in range(menu_size)
+        ]
+        menus[restaurant_id] = menu
+        redis_docs[restaurant_id] = {
+            '_id': restaurant_id,
+            'name': f'Ресторан {r}',
+            'menu': menu,
+            'update_ts_utc': update_ts
+        }
+
+    restaurant_ids = list(menus)
+    started = datetime(2023, 2, 1)
+    messages = []
+    for i in range(orders):
+        restaurant_id = rnd.choice(restaurant_ids)
+        order_items = [
+            {'id': item['_id'], 'name': item['name'], 'price': item['price'], 'quantity': rnd.randint(1, 3)}
+            for item in rnd.sample(menus[restaurant_id], rnd.randint(1, max_items))
+        ]
+        cost = sum(item['price'] * item['quantity'] for item in order_items)
+        order_dt = (started + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')
+        messages.append({
+            'object_id': 1000000 + i,
+            'object_type': 'order',
+            'sent_dttm': order_dt,
+            'payload': {
+                'restaurant': {'id': restaurant_id},
+                'date': order_dt,
+                'user': {'id': rnd.choice(user_ids)},
+                'order_items': order_items,
+                'bonus_payment': 0,
+                'cost': cost,
+                'payment': cost,
+                'bonus_grant': 0,
+                'statuses': [{'status': 'CLOSED', 'dttm': order_dt}],
+                'final_status': 'CLOSED',
+                'update_ts': order_dt
+            }
+        })
+    return messages, redis_docs
+
+
+def save(path: str, messages: List[Dict]) -> None:
+    """сообщения топика - по одному json на строку"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for message in messages:
+            f.write(json.dumps(message, ensure_ascii=False))
+            f.write('\n')
+
+
+def load(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,131 @@
+"""
+Офлайн-бенчмарк конвейера stg -> dds -> cdm.
+
+Настоящие StgMessageProcessor, DdsMessageProcessor и CdmMessageProcessor прогоняются
+на локальном Postgres, а Kafka и Redis заменены заглушками в памяти (fakes.py).
+Поток заказов генерируется (order_stream.py) или берётся из записи (--input, --redis-docs);
+сообщения, отправленные каждым сервисом, становятся входным топиком следующего.
+
+По каждому сервису печатаются: сообщений в секунду, p50/p99 задержки сообщения,
+SQL-запросов и round-trip-ов к Postgres на сообщение и самые дорогие этапы обработки.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import psycopg
+
+import order_stream
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICES = ('stg', 'dds', 'cdm')
+
+
+def reset_schema(dsn: str) -> None:
+    with open(os.path.join(BENCHMARKS_DIR, 'schema.sql'), encoding='utf-8') as f:
+        schema = f.read()
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(schema)
+
+
+def run_service(service: str, args, input_path: str, output_path: str, redis_docs_path: str) -> dict:
+    cmd = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, 'replay_service.py'), service,
+        '--dsn', args.dsn,
+        '--input', input_path,
+        '--output', output_path,
+        '--batch-size-min', str(args.batch_size_min),
+        '--batch-size-max', str(args.batch_size_max),
+        '--pg-pool-size', str(args.pg_pool_size),
+        '--pg-prepare-threshold', str(args.pg_prepare_threshold),
+    ]
+    if service == 'stg':
+        cmd += ['--redis-docs', redis_docs_path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout)
+
+
+def print_report(results: list, top_stages: int) -> None:
+    header = f"{'service':<8}{'msgs':>8}{'msg/s':>10}{'p50 ms':>10}{'p99 ms':>10}" \
+             f"{'stmt/msg':>10}{'rt/msg':>10}{'sql ms/msg':>12}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(
+            f"{r['service']:<8}{r['messages']:>8}{r['msgs_per_sec']:>10.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+            f"{r['statements_per_msg']:>10.3f}{r['round_trips_per_msg']:>10.3f}{r['sql_ms_per_msg']:>12.3f}"
+        )
+
+    for r in results:
+        print(f"\n{r['service']}: {r['batches']} batches, {r['produced']} produced", end='')
+        if r['redis_calls_per_msg'] is not None:
+            print(f", {r['redis_calls_per_msg']:.3f} redis calls/msg", end='')
+        print()
+        for stage, stat in list(r['stages'].items())[:top_stages]:
+            print(f"  {stage:<36}{stat['per_message_ms'] or 0:>10.3f} ms/msg{stat['count']:>8} calls")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.getenv('BENCH_PG_DSN'),
+                        help='подключение к локальному Postgres (по умолчанию - $BENCH_PG_DSN); '
+                             'схемы stg, dds и cdm в нём пересоздаются')
+    parser.add_argument('--orders', type=int, default=5000, help='сколько заказов сгенерировать')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--restaurants', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--input', help='записанный исходный топик stg: по сообщению (json) на строку')
+    parser.add_argument('--redis-docs', help='документы Redis к записанному топику (json: ключ -> документ)')
+    parser.add_argument('--services', default=','.join(SERVICES),
+                        help='какие сервисы прогнать (по порядку конвейера), например stg,dds')
+    parser.add_argument('--batch-size-min', type=int, default=10)
+    parser.add_argument('--batch-size-max', type=int, default=500)
+    parser.add_argument('--pg-pool-size', type=int, default=4)
+    parser.add_argument('--pg-prepare-threshold', type=int, default=0)
+    parser.add_argument('--workdir', help='куда сложить потоки сообщений (по умолчанию - временный каталог)')
+    parser.add_argument('--top-stages', type=int, default=8)
+    parser.add_argument('--json', help='записать результаты в json-файл (для сравнения прогонов)')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('--dsn or BENCH_PG_DSN is required')
+    if bool(args.input) != bool(args.redis_docs):
+        parser.error('--input and --redis-docs go together')
+    services = [s for s in SERVICES if s in args.services.split(',')]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='replay-')
+    os.makedirs(workdir, exist_ok=True)
+    input_path, redis_docs_path = args.input, args.redis_docs
+    if input_path is None:
+        messages, redis_docs = order_stream.generate(
+            args.orders, users=args.users, restaurants=args.restaurants, seed=args.seed
+        )
+        input_path = os.path.join(workdir, 'stg_input.jsonl')
+        redis_docs_path = os.path.join(workdir, 'redis_docs.json')
+        order_stream.save(input_path, messages)
+        with open(redis_docs_path, 'w', encoding='utf-8') as f:
+            json.dump(redis_docs, f, ensure_ascii=False)
+
+    reset_schema(args.dsn)
+
+    results = []
+    for i, service in enumerate(SERVICES):
+        output_path = os.path.join(workdir, f'{service}_output.jsonl')
+        if service in services:
+            results.append(run_service(service, args, input_path, output_path, redis_docs_path))
+        elif set(SERVICES[i + 1:]) & set(services) and not os.path.exists(output_path):
+            # вход следующего сервиса берётся из прошлого прогона с тем же --workdir
+            parser.error(f'{service} is skipped, but there is no {output_path} from an earlier run')
+        input_path = output_path
+
+    print_report(results, args.top_stages)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Прогон одного сервиса (stg, dds или cdm) на записанном потоке сообщений.
+Запускается из replay.py отдельным процессом: у сервисов одинаково называются пакеты lib,
+поэтому в один процесс их не загрузить. Результат - json в stdout.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIRS = {
+    'stg': 'service_stg',
+    'dds': 'service_dds',
+    'cdm': 'service_cdm',
+}
+
+
+def percentile(values, q: float) -> float:
+    """перцентиль по ближайшему рангу; values - отсортированный список"""
+    if not values:
+        return 0.0
+    rank = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def make_processor(service: str, args, consumer, producer, redis_client, db, lag_monitor, logger):
+    if service == 'stg':
+        from lib.redis import RedisCache
+        from stg_loader.repository.stg_repository import StgRepository
+        from stg_loader.stg_message_processor_job import StgMessageProcessor
+        return StgMessageProcessor(
+            consumer,
+            producer,
+            RedisCache(redis_client, args.redis_cache_size),
+            StgRepository(db),
+            lag_monitor,
+            logger
+        )
+
+    if service == 'dds':
+        from dds_loader.dds_message_processor_job import DdsMessageProcessor
+        from dds_loader.repository.dds_repository import DdsRepository
+        DdsRepository(db).init_schema()
+        return DdsMessageProcessor(consumer, producer, DdsRepository(db), lag_monitor, logger)
+
+    from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+    from cdm_loader.repository.cdm_repository import CdmRepository
+    return CdmMessageProcessor(consumer, CdmRepository(db), lag_monitor, logger)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('service', choices=sorted(SERVICE_DIRS))
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--input', required=True, help='входной топик: по сообщению (json) на строку')
+    parser.add_argument('--output', help='куда записать сообщения, отправленные сервисом')
+    parser.add_argument('--redis-docs', help='документы Redis (json: ключ -> документ), для stg')
+    parser.add_argument('--redis-cache-size', type=int, default=1000)
+    parser.add_argument('--batch-size-min', type=int, default=10)
+    parser.add_argument('--batch-size-max', type=int, default=500)
+    parser.add_argument('--lag-high', type=int, default=5000)
+    parser.add_argument('--pg-pool-size', type=int, default=4)
+    parser.add_argument('--pg-prepare-threshold', type=int, default=0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', SERVICE_DIRS[args.service], 'src'))
+
+    from psycopg.conninfo import conninfo_to_dict
+
+    from fakes import FakeKafkaConsumer, FakeKafkaProducer, FakeRedisClient
+    from lib.kafka_connect import LagMonitor
+    from lib.metrics.stage_profiler import profiler
+    from lib.pg import PgConnect
+    from sql_counter import sql_counter
+
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+    logger = logging.getLogger(f'replay-{args.service}')
+
+    with open(args.input, 'rb') as f:
+        values = [line.rstrip(b'\n') for line in f if line.strip()]
+    redis_client = None
+    if args.redis_docs:
+        with open(args.redis_docs, encoding='utf-8') as f:
+            redis_client = FakeRedisClient(json.load(f))
+
+    conninfo = conninfo_to_dict(args.dsn)
+    db = PgConnect(
+        conninfo.get('host', 'localhost'),
+        int(conninfo.get('port', 5432)),
+        conninfo.get('dbname', 'postgres'),
+        conninfo.get('user', 'postgres'),
+        conninfo.get('password', ''),
+        sslmode=conninfo.get('sslmode', 'disable'),
+        pool_min_size=args.pg_pool_size,
+        pool_max_size=args.pg_pool_size,
+        prepare_threshold=args.pg_prepare_threshold
+    )
+    sql_counter.install()
+
+    consumer = FakeKafkaConsumer(values)
+    producer = FakeKafkaProducer()
+    # отставание "топика" известно точно, так что перезапрашиваем его перед каждой пачкой
+    lag_monitor = LagMonitor(consumer, args.batch_size_min, args.batch_size_max, args.lag_high, check_interval=0)
+    processor = make_processor(args.service, args, consumer, producer, redis_client, db, lag_monitor, logger)
+
+    # подготовка схемы (dds) в замеры не входит
+    sql_before = sql_counter.snapshot()
+    profiler.sample_rate = 1.0
+    profiler.reset()
+
+    # задержка сообщения - время run(), в котором его пачка прочитана, записана и закоммичена
+    latencies = []
+    batches = 0
+    total_seconds = 0.0
+    while True:
+        started = time.perf_counter()
+        with profiler.run():
+            processed = processor.run()
+        elapsed = time.perf_counter() - started
+        if not processed:
+            break
+        batches += 1
+        total_seconds += elapsed
+        latencies.extend([elapsed] * processed)
+    db.close()
+
+    if args.output:
+        with open(args.output, 'wb') as f:
+            for value in producer.values:
+                f.write(value)
+                f.write(b'\n')
+
+    messages = len(latencies)
+    latencies.sort()
+    sql = {k: v - sql_before[k] for k, v in sql_counter.snapshot().items()}
+    per_message = 1 / messages if messages else 0.0
+    print(json.dumps({
+        'service': args.service,
+        'messages': messages,
+        'batches': batches,
+        'produced': len(producer.values),
+        'seconds': total_seconds,
+        'msgs_per_sec': messages / total_seconds if total_seconds else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statements_per_msg': sql['statements'] * per_message,
+        'round_trips_per_msg': sql['round_trips'] * per_message,
+        'sql_ms_per_msg': sql['seconds'] * 1000 * per_message,
+        'redis_calls_per_msg': redis_client.calls * per_message if redis_client is not None else None,
+        'stages': profiler.snapshot()['stages']
+    }))
+
+
+if __name__ == '__main__':
+    main()
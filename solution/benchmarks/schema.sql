@@ -0,0 +1,147 @@
+-- схемы stg, dds и cdm для прогона бенчмарка на локальном Postgres.
+-- Пересоздаются с нуля перед каждым прогоном: hashdiff сателлитов и таблицы счётчиков dds
+-- DDS-сервис доращивает сам (DdsRepository.init_schema).
+
+DROP SCHEMA IF EXISTS stg CASCADE;
+DROP SCHEMA IF EXISTS dds CASCADE;
+DROP SCHEMA IF EXISTS cdm CASCADE;
+
+CREATE SCHEMA stg;
+CREATE SCHEMA dds;
+CREATE SCHEMA cdm;
+
+CREATE TABLE stg.order_events (
+    id serial PRIMARY KEY,
+    object_id int NOT NULL UNIQUE,
+    payload json NOT NULL,
+    object_type varchar NOT NULL,
+    sent_dttm timestamp NOT NULL
+);
+
+CREATE TABLE dds.h_order (
+    h_order_pk uuid PRIMARY KEY,
+    order_id int NOT NULL,
+    order_dt timestamp NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.h_user (
+    h_user_pk uuid PRIMARY KEY,
+    user_id varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.h_restaurant (
+    h_restaurant_pk uuid PRIMARY KEY,
+    restaurant_id varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.h_product (
+    h_product_pk uuid PRIMARY KEY,
+    product_id varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.h_category (
+    h_category_pk uuid PRIMARY KEY,
+    category_name varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.l_order_product (
+    hk_order_product_pk uuid PRIMARY KEY,
+    h_order_pk uuid NOT NULL REFERENCES dds.h_order,
+    h_product_pk uuid NOT NULL REFERENCES dds.h_product,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.l_product_restaurant (
+    hk_product_restaurant_pk uuid PRIMARY KEY,
+    h_product_pk uuid NOT NULL REFERENCES dds.h_product,
+    h_restaurant_pk uuid NOT NULL REFERENCES dds.h_restaurant,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.l_product_category (
+    hk_product_category_pk uuid PRIMARY KEY,
+    h_product_pk uuid NOT NULL REFERENCES dds.h_product,
+    h_category_pk uuid NOT NULL REFERENCES dds.h_category,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.l_order_user (
+    hk_order_user_pk uuid PRIMARY KEY,
+    h_order_pk uuid NOT NULL REFERENCES dds.h_order,
+    h_user_pk uuid NOT NULL REFERENCES dds.h_user,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.s_user_names (
+    hk_user_names_pk uuid PRIMARY KEY,
+    h_user_pk uuid NOT NULL REFERENCES dds.h_user,
+    username varchar NOT NULL,
+    userlogin varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.s_product_names (
+    hk_product_names_pk uuid PRIMARY KEY,
+    h_product_pk uuid NOT NULL REFERENCES dds.h_product,
+    name varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.s_restaurant_names (
+    hk_restaurant_names_pk uuid PRIMARY KEY,
+    h_restaurant_pk uuid NOT NULL REFERENCES dds.h_restaurant,
+    name varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.s_order_cost (
+    hk_order_cost_pk uuid PRIMARY KEY,
+    h_order_pk uuid NOT NULL REFERENCES dds.h_order,
+    cost decimal(19, 5) NOT NULL DEFAULT 0 CHECK (cost >= 0),
+    payment decimal(19, 5) NOT NULL DEFAULT 0 CHECK (payment >= 0),
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE dds.s_order_status (
+    hk_order_status_pk uuid PRIMARY KEY,
+    h_order_pk uuid NOT NULL REFERENCES dds.h_order,
+    status varchar NOT NULL,
+    load_dt timestamp NOT NULL,
+    load_src varchar NOT NULL
+);
+
+CREATE TABLE cdm.user_product_counters (
+    id serial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    product_id uuid NOT NULL,
+    product_name varchar NOT NULL,
+    order_cnt int NOT NULL CHECK (order_cnt >= 0),
+    UNIQUE (user_id, product_id)
+);
+
+CREATE TABLE cdm.user_category_counters (
+    id serial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    category_id uuid NOT NULL,
+    category_name varchar NOT NULL,
+    order_cnt int NOT NULL CHECK (order_cnt >= 0),
+    UNIQUE (user_id, category_id)
+);
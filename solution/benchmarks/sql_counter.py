@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+from typing import Generator
+
+import psycopg
+from psycopg import pq
+
+
+class SqlCounter:
+    """
+    считает SQL-запросы и round-trip-ы к Postgres всех подключений процесса:
+    оборачивает Cursor.execute/executemany и Connection.commit/rollback psycopg.
+
+    statements - выполненные запросы (executemany - по запросу на набор параметров),
+    round_trips - обмены с сервером: запрос, неявный BEGIN перед первым запросом транзакции,
+    COMMIT/ROLLBACK; executemany в pipeline-режиме - один обмен на весь вызов.
+    seconds - время внутри этих вызовов.
+    """
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.round_trips = 0
+        self.seconds = 0.0
+        self._installed = False
+
+    def install(self) -> None:
+        if self._installed:
+            return
+        self._installed = True
+        counter = self
+        cursor_execute = psycopg.Cursor.execute
+        cursor_executemany = psycopg.Cursor.executemany
+        connection_commit = psycopg.Connection.commit
+        connection_rollback = psycopg.Connection.rollback
+        pipelined = psycopg.Pipeline.is_supported()
+
+        def execute(cursor, query, params=None, **kwargs):
+            with counter._measure(cursor.connection, statements=1, round_trips=1):
+                return cursor_execute(cursor, query, params, **kwargs)
+
+        def executemany(cursor, query, params_seq, **kwargs):
+            params_seq = list(params_seq)
+            round_trips = 1 if pipelined else len(params_seq)
+            with counter._measure(cursor.connection, statements=len(params_seq), round_trips=round_trips):
+                return cursor_executemany(cursor, query, params_seq, **kwargs)
+
+        def commit(connection):
+            with counter._measure_end(connection):
+                return connection_commit(connection)
+
+        def rollback(connection):
+            with counter._measure_end(connection):
+                return connection_rollback(connection)
+
+        psycopg.Cursor.execute = execute
+        psycopg.Cursor.executemany = executemany
+        psycopg.Connection.commit = commit
+        psycopg.Connection.rollback = rollback
+
+    def snapshot(self) -> dict:
+        return {'statements': self.statements, 'round_trips': self.round_trips, 'seconds': self.seconds}
+
+    @contextmanager
+    def _measure(self, connection: psycopg.Connection, statements: int, round_trips: int) -> Generator[None, None, None]:
+        # вне autocommit перед первым запросом транзакции psycopg отдельно шлёт BEGIN
+        if not connection.autocommit and connection.pgconn.transaction_status == pq.TransactionStatus.IDLE:
+            round_trips += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.statements += statements
+            self.round_trips += round_trips
+
+    @contextmanager
+    def _measure_end(self, connection: psycopg.Connection) -> Generator[None, None, None]:
+        # без открытой транзакции commit/rollback на сервер не ходят
+        round_trips = 0 if connection.pgconn.transaction_status == pq.TransactionStatus.IDLE else 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.round_trips += round_trips
+
+
+# общий счётчик процесса бенчмарка
+sql_counter = SqlCounter()
@@ -1,6 +1,6 @@
 import os
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
+from lib.kafka_connect import KafkaConsumer, KafkaProducer, LagMonitor
 from lib.pg import PgConnect
 
 
@@ -8,6 +8,23 @@ class AppConfig:
     CERTIFICATE_PATH = '/crt/YandexInternalRootCA.crt'
 
     def __init__(self) -> None:
+        # пауза между опросами пустого топика: растёт от min до max, пока сообщений нет
+        self.idle_backoff_min = float(os.getenv('IDLE_BACKOFF_MIN') or 0.1)
+        self.idle_backoff_max = float(os.getenv('IDLE_BACKOFF_MAX') or 5)
+        # сколько воркеров (потоков со своим consumer-ом в общей группе) обрабатывают сообщения;
+        # больше, чем партиций в исходном топике, ставить смысла нет
+        self.processor_workers = int(os.getenv('PROCESSOR_WORKERS') or 1)
+
+        # размер пачки подбирается по отставанию консьюмера: от BATCH_SIZE_MIN (отставания нет)
+        # до BATCH_SIZE_MAX (отставание LAG_HIGH сообщений и больше); отставание перезапрашивается
+        # у Kafka раз в LAG_CHECK_INTERVAL секунд
+        self.batch_size_min = int(os.getenv('BATCH_SIZE_MIN') or 10)
+        self.batch_size_max = int(os.getenv('BATCH_SIZE_MAX') or 500)
+        self.lag_high = int(os.getenv('LAG_HIGH') or 5000)
+        self.lag_check_interval = float(os.getenv('LAG_CHECK_INTERVAL') or 5)
+
+        # доля запусков обработчика, для которых профайлер копит время этапов (см. /debug/profile)
+        self.profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE') or 0.01)
 
         self.kafka_host = str(os.getenv('KAFKA_HOST'))
         self.kafka_port = int(str(os.getenv('KAFKA_PORT')))
@@ -25,6 +42,16 @@ class AppConfig:
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER'))
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD'))
 
+        # пул подключений к PG; PG_POOL_MAX_SIZE=0 - без пула, подключение на каждый запрос
+        self.pg_pool_min_size = int(os.getenv('PG_POOL_MIN_SIZE') or 1)
+        self.pg_pool_max_size = int(os.getenv('PG_POOL_MAX_SIZE') or 4)
+        self.pg_pool_max_idle = float(os.getenv('PG_POOL_MAX_IDLE') or 300)
+        self.pg_pool_max_lifetime = float(os.getenv('PG_POOL_MAX_LIFETIME') or 3600)
+        # server-side prepared statements: после скольких выполнений запроса готовить его
+        # на подключении; PG_PREPARE_THRESHOLD=none - не готовить (для пулеров без их поддержки)
+        pg_prepare_threshold = str(os.getenv('PG_PREPARE_THRESHOLD') or 0)
+        self.pg_prepare_threshold = None if pg_prepare_threshold.lower() == 'none' else int(pg_prepare_threshold)
+
     def kafka_producer(self):
         return KafkaProducer(
             self.kafka_host,
@@ -35,6 +62,15 @@ class AppConfig:
             self.CERTIFICATE_PATH
         )
 
+    def lag_monitor(self, consumer: KafkaConsumer) -> LagMonitor:
+        return LagMonitor(
+            consumer,
+            self.batch_size_min,
+            self.batch_size_max,
+            self.lag_high,
+            self.lag_check_interval
+        )
+
     def kafka_consumer(self):
         return KafkaConsumer(
             self.kafka_host,
@@ -52,5 +88,10 @@ class AppConfig:
             self.pg_warehouse_port,
             self.pg_warehouse_dbname,
             self.pg_warehouse_user,
-            self.pg_warehouse_password
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=self.pg_pool_max_size,
+            pool_max_idle=self.pg_pool_max_idle,
+            pool_max_lifetime=self.pg_pool_max_lifetime,
+            prepare_threshold=self.pg_prepare_threshold
         )
@@ -1,37 +1,96 @@
 import uuid
 from datetime import datetime
 from logging import Logger
+from typing import Dict, List
 
-from lib.kafka_connect import KafkaConsumer
+import psycopg
+from confluent_kafka import KafkaException
+
+from lib.kafka_connect import BatchRetry, KafkaConsumer, KafkaMessage, LagMonitor
+from lib.metrics import processor_metrics
 from lib.pg import PgConnect
 from cdm_loader.repository.cdm_repository import CdmRepository
 
+# недоступность PG или Kafka: такие пачки повторяем, пока не получится, а не пропускаем
+_TRANSIENT_ERRORS = (psycopg.OperationalError, KafkaException)
+
 
 class CdmMessageProcessor:
     _kafka_consumer: KafkaConsumer = None
     _cdm_repository: CdmRepository = None
     _logger: Logger = None
-    _batch_size: int = 100
+    _lag_monitor: LagMonitor = None
+    _batch_retry: BatchRetry = None
 
     def __init__(self,
                  kafka_consumer: KafkaConsumer,
                  cdm_repository: CdmRepository,
+                 lag_monitor: LagMonitor,
                  logger: Logger) -> None:
         self._kafka_consumer = kafka_consumer
         self._cdm_repository = cdm_repository
+        self._lag_monitor = lag_monitor
+        self._batch_retry = BatchRetry(kafka_consumer, logger, transient_errors=_TRANSIENT_ERRORS)
         self._logger = logger
-        # forced
-        self._batch_size = 100
 
-    def run(self) -> None:
-        self._logger.info(f"{datetime.utcnow()}: START")
+    def run(self) -> int:
+        """
+        обрабатывает одну пачку сообщений; вызывается в цикле из ProcessorRunner.
+        на выходе - количество обработанных сообщений (0 - в Kafka пусто).
+        """
+
+        # Step 1. Получаем пачку сообщений из Kafka с помощью `consume_batch()`.
+        # размер пачки и таймаут опроса - по отставанию консьюмера
+        if self._lag_monitor.update():
+            processor_metrics.consumer_lag(self._lag_monitor.lag)
+        # время опроса Kafka (kafka_poll) и декодирования (kafka_decode) замеряет сам consume_batch
+        messages = self._kafka_consumer.consume_batch(
+            self._lag_monitor.batch_size(),
+            timeout=self._lag_monitor.poll_timeout()
+        )
+        if not messages:
+            return 0
+
+        self._logger.info(f"{datetime.utcnow()}: START, {len(messages)} messages")
+
+        # если пачка не записалась, BatchRetry возвращает позицию чтения на её начало,
+        # чтобы следующий run() прочитал её заново, а не закоммитил оффсеты поверх;
+        # сообщения, которые падают при каждой попытке, после нескольких повторов пропускаются
+        self._batch_retry.process(messages, self._process_batch)
+
+        # Step 2. Пачка записана в PG - фиксируем оффсеты.
+        with processor_metrics.stage('kafka_commit'):
+            self._kafka_consumer.commit(messages)
+        processor_metrics.batch_done(len(messages))
+
+        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        return len(messages)
+
+    def close(self) -> None:
+        self._kafka_consumer.close()
+
+    def lag(self) -> Dict[int, int]:
+        """последнее известное отставание консьюмера: партиция -> сообщений"""
+        return self._lag_monitor.lag
 
-        processed_messages = 0;
-        timeout: float = 3.0
-        while processed_messages < self._batch_size:
-            # Step 1. Получаем сообщение из Kafka с помощью `consume()`.
-            dct_msg = self._kafka_consumer.consume(timeout=timeout)
+    def _process_batch(self, messages: List[KafkaMessage]) -> None:
+        batch_product_counters = []
+        batch_category_counters = []
+        for message in messages:
+            dct_msg = message.value
             # message example (пример реализованного контракта)
+            # одно сообщение 'object_type': 'user_counters' на пользователя за пачку dds-сервиса
+            # (ключ сообщения в Kafka - тоже h_user_pk)
+            # {
+            #   'object_id': '1058719d-c8f0-3a48-ad7a-87d1678fdf8e',
+            #   'object_type': 'user_counters',
+            #   'payload': {
+            #     'id': '1058719d-c8f0-3a48-ad7a-87d1678fdf8e',
+            #     'product_counters': [ ... как counters в 'user_product_counters' ... ],
+            #     'category_counters': [ ... как counters в 'user_category_counters' ... ]
+            #   }
+            # }
+            # прежний контракт (ещё может встретиться в топике):
             # одно сообщение 'object_type': 'user_product_counters'
             # {
             #   'object_id': 'dd2854ab-fdf5-44a7-9682-da9317418577',
@@ -70,33 +129,25 @@ class CdmMessageProcessor:
             # а вот и случай, когда у нас в топике сообщения разных типов:
             if 'object_type' not in dct_msg:
                 continue
-            if (
-                dct_msg['object_type'] != 'user_product_counters'
-                and dct_msg['object_type'] != 'user_category_counters'
-            ):
+            if dct_msg['object_type'] not in ('user_counters', 'user_product_counters', 'user_category_counters'):
                 continue
 
-            if dct_msg['object_type'] == 'user_product_counters':
-                # upsert user_product_counters
-                for next_counter in dct_msg['payload']['counters']:
-                    h_user_pk = next_counter['h_user_pk']
-                    h_product_pk = next_counter['h_product_pk']
-                    product_name = next_counter['product_name']
-                    order_cnt = next_counter['order_cnt']
-                    self._cdm_repository.user_product_counters_upsert(
-                        h_user_pk, h_product_pk, product_name, order_cnt
-                    )
-            elif dct_msg['object_type'] == 'user_category_counters':
-                # upsert user_category_counters
-                for next_counter in dct_msg['payload']['counters']:
-                    h_user_pk = next_counter['h_user_pk']
-                    h_category_pk = next_counter['h_category_pk']
-                    category_name = next_counter['category_name']
-                    order_cnt = next_counter['order_cnt']
-                    self._cdm_repository.user_category_counters_upsert(
-                        h_user_pk, h_category_pk, category_name, order_cnt
-                    )
+            if dct_msg['object_type'] == 'user_counters':
+                product_counters = dct_msg['payload']['product_counters']
+                category_counters = dct_msg['payload']['category_counters']
+            elif dct_msg['object_type'] == 'user_product_counters':
+                product_counters = dct_msg['payload']['counters']
+                category_counters = []
             else:
-                pass
+                product_counters = []
+                category_counters = dct_msg['payload']['counters']
 
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+            batch_product_counters.extend(product_counters)
+            batch_category_counters.extend(category_counters)
+
+        # счётчики всей пачки - одним upsert-ом на витрину,
+        # повторы ключей внутри пачки схлопываются (побеждает наибольший счётчик)
+        with processor_metrics.stage('pg_upsert_user_product_counters'):
+            self._cdm_repository.user_product_counters_upsert_batch(batch_product_counters)
+        with processor_metrics.stage('pg_upsert_user_category_counters'):
+            self._cdm_repository.user_category_counters_upsert_batch(batch_category_counters)
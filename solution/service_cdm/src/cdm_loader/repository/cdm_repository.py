@@ -12,62 +12,88 @@ class CdmRepository:
     def __init__(self, db: PgConnect) -> None:
         self._db = db
 
-    def user_category_counters_upsert(self,
-                                      h_user_pk: str, h_category_pk: str,
-                                      category_name: str, order_cnt: int) -> None:
-        """upsert user_category_counters"""
+    def user_category_counters_upsert_batch(self, counters: List[Dict[str, Any]]) -> None:
+        """
+        upsert пачки счётчиков user_category_counters одним INSERT ... SELECT FROM unnest(...).
+        counters - словари с ключами "h_user_pk", "h_category_pk", "category_name", "order_cnt";
+        Счётчики заказов только растут, а сообщения от разных воркеров dds могут прийти
+        не по порядку, поэтому повторы (h_user_pk, h_category_pk) схлопываются в наибольший order_cnt,
+        и order_cnt в витрине тоже не уменьшается (GREATEST).
+        """
+
+        rows = {}
+        for counter in counters:
+            key = (counter['h_user_pk'], counter['h_category_pk'])
+            if key not in rows or counter['order_cnt'] >= rows[key]['order_cnt']:
+                rows[key] = counter
+        if not rows:
+            return
+        # по возрастанию ключа - чтобы параллельные воркеры не ловили deadlock
+        rows = [rows[key] for key in sorted(rows)]
 
         upsert_statement = """
             INSERT INTO cdm.user_category_counters
                 (user_id, category_id, category_name, order_cnt)
-            VALUES
-                (
-                    '{upsert_h_user_pk}',
-                    '{upsert_h_category_pk}',
-                    '{upsert_category_name}',
-                    {upsert_order_cnt}
-                )
+            SELECT
+                "u"."user_id", "u"."category_id", "u"."category_name", "u"."order_cnt"
+            FROM unnest(
+                %(user_ids)s::uuid[], %(category_ids)s::uuid[], %(category_names)s::varchar[], %(order_cnts)s::int[]
+            ) AS "u" ("user_id", "category_id", "category_name", "order_cnt")
             ON CONFLICT (user_id, category_id) DO UPDATE
             SET
                 category_name = EXCLUDED.category_name,
-                order_cnt = EXCLUDED.order_cnt
+                order_cnt = GREATEST(cdm.user_category_counters.order_cnt, EXCLUDED.order_cnt)
             ;
-        """.format(
-            upsert_h_user_pk=h_user_pk,
-            upsert_h_category_pk=h_category_pk,
-            upsert_category_name=category_name,
-            upsert_order_cnt=order_cnt
-        )
+        """
+        params = {
+            'user_ids': [counter['h_user_pk'] for counter in rows],
+            'category_ids': [counter['h_category_pk'] for counter in rows],
+            'category_names': [counter['category_name'] for counter in rows],
+            'order_cnts': [counter['order_cnt'] for counter in rows]
+        }
         with self._db.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(upsert_statement)
+                cur.execute(upsert_statement, params)
+
+    def user_product_counters_upsert_batch(self, counters: List[Dict[str, Any]]) -> None:
+        """
+        upsert пачки счётчиков user_product_counters одним INSERT ... SELECT FROM unnest(...).
+        counters - словари с ключами "h_user_pk", "h_product_pk", "product_name", "order_cnt";
+        Счётчики заказов только растут, а сообщения от разных воркеров dds могут прийти
+        не по порядку, поэтому повторы (h_user_pk, h_product_pk) схлопываются в наибольший order_cnt,
+        и order_cnt в витрине тоже не уменьшается (GREATEST).
+        """
 
-    def user_product_counters_upsert(self,
-                                     h_user_pk: str, h_product_pk: str,
-                                     product_name: str, order_cnt: int) -> None:
-        """upsert user_product_counters"""
+        rows = {}
+        for counter in counters:
+            key = (counter['h_user_pk'], counter['h_product_pk'])
+            if key not in rows or counter['order_cnt'] >= rows[key]['order_cnt']:
+                rows[key] = counter
+        if not rows:
+            return
+        # по возрастанию ключа - чтобы параллельные воркеры не ловили deadlock
+        rows = [rows[key] for key in sorted(rows)]
 
         upsert_statement = """
             INSERT INTO cdm.user_product_counters
                 (user_id, product_id, product_name, order_cnt)
-            VALUES
-                (
-                    '{upsert_h_user_pk}',
-                    '{upsert_h_product_pk}',
-                    '{upsert_product_name}',
-                    {upsert_order_cnt}
-                )
+            SELECT
+                "u"."user_id", "u"."product_id", "u"."product_name", "u"."order_cnt"
+            FROM unnest(
+                %(user_ids)s::uuid[], %(product_ids)s::uuid[], %(product_names)s::varchar[], %(order_cnts)s::int[]
+            ) AS "u" ("user_id", "product_id", "product_name", "order_cnt")
             ON CONFLICT (user_id, product_id) DO UPDATE
             SET
                 product_name = EXCLUDED.product_name,
-                order_cnt = EXCLUDED.order_cnt
+                order_cnt = GREATEST(cdm.user_product_counters.order_cnt, EXCLUDED.order_cnt)
             ;
-        """.format(
-            upsert_h_user_pk=h_user_pk,
-            upsert_h_product_pk=h_product_pk,
-            upsert_product_name=product_name,
-            upsert_order_cnt=order_cnt
-        )
+        """
+        params = {
+            'user_ids': [counter['h_user_pk'] for counter in rows],
+            'product_ids': [counter['h_product_pk'] for counter in rows],
+            'product_names': [counter['product_name'] for counter in rows],
+            'order_cnts': [counter['order_cnt'] for counter in rows]
+        }
         with self._db.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(upsert_statement)
+                cur.execute(upsert_statement, params)
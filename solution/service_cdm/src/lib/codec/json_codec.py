@@ -0,0 +1,38 @@
+import json
+import os
+from typing import Any, Union
+
+# orjson работает напрямую с bytes и в разы быстрее stdlib json;
+# если его нет (или JSON_CODEC=json) - используем stdlib.
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+if orjson is not None and os.getenv('JSON_CODEC', 'orjson') != 'json':
+    BACKEND = 'orjson'
+else:
+    BACKEND = 'json'
+
+
+def dumps(obj: Any) -> bytes:
+    """сериализует объект в json (utf-8 bytes)"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def dumps_str(obj: Any) -> str:
+    """сериализует объект в json-строку"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """разбирает json из bytes или строки"""
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
@@ -1 +1,3 @@
-from .kafka_connectors import KafkaConsumer, KafkaProducer  # noqa
+from .kafka_connectors import KafkaConsumer, KafkaDeliveryError, KafkaMessage, KafkaProducer  # noqa
+from .lag_monitor import LagMonitor  # noqa
+from .batch_retry import BatchRetry  # noqa
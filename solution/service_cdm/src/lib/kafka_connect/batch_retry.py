@@ -0,0 +1,68 @@
+from logging import Logger
+from typing import Callable, List, Tuple, Type
+
+from lib.metrics import processor_metrics
+
+from .kafka_connectors import KafkaConsumer, KafkaMessage
+
+
+class BatchRetry:
+    """
+    ограничивает повторы пачки, которая падает при каждой обработке.
+    Первые max_attempts неудач подряд пачка перечитывается целиком (consumer.rewind) -
+    так переживаются временные сбои.
+    Дальше пачка разбирается по одному сообщению: сообщения, которые падают и поодиночке,
+    пропускаются с записью в лог, остальные обрабатываются, и пачка коммитится как обычно.
+    Ошибки из transient_errors (недоступность PG, Redis, Kafka) пропуском не лечатся -
+    на них пачка всегда перечитывается заново, и в счёт попыток они не идут.
+    """
+
+    def __init__(self,
+                 consumer: KafkaConsumer,
+                 logger: Logger,
+                 max_attempts: int = 3,
+                 transient_errors: Tuple[Type[BaseException], ...] = ()
+                 ) -> None:
+        self._consumer = consumer
+        self._logger = logger
+        self._max_attempts = max_attempts
+        self._transient_errors = transient_errors
+        self._failures = 0
+
+    def process(self, messages: List[KafkaMessage], process_batch: Callable[[List[KafkaMessage]], None]) -> None:
+        """
+        обрабатывает пачку функцией process_batch. Если пачка не обработана -
+        позиция чтения возвращается на её начало и исключение пробрасывается дальше.
+        """
+        try:
+            process_batch(messages)
+            self._failures = 0
+            return
+        except self._transient_errors:
+            self._consumer.rewind(messages)
+            raise
+        except Exception:
+            self._failures += 1
+            if self._failures < self._max_attempts:
+                self._consumer.rewind(messages)
+                raise
+            self._logger.exception(
+                f"batch of {len(messages)} messages failed {self._failures} times in a row, "
+                f"processing it message by message"
+            )
+
+        try:
+            for message in messages:
+                try:
+                    process_batch([message])
+                except self._transient_errors:
+                    raise
+                except Exception:
+                    self._logger.exception(
+                        f"skipping message {message.topic}[{message.partition}]@{message.offset}"
+                    )
+                    processor_metrics.message_skipped()
+        except Exception:
+            self._consumer.rewind(messages)
+            raise
+        self._failures = 0
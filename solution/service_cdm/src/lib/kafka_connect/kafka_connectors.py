@@ -1,13 +1,33 @@
-import json
-from typing import Dict, Optional
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from confluent_kafka import Consumer, Producer
+from confluent_kafka import Consumer, KafkaException, Producer, TopicPartition
+
+from lib.codec import json_codec
+from lib.metrics import processor_metrics
 
 
 def error_callback(err):
     print('Something went wrong: {}'.format(err))
 
 
+def commit_callback(err, partitions):
+    if err is not None:
+        print('Offset commit failed: {} {}'.format(err, partitions))
+
+
+@dataclass
+class KafkaMessage:
+    topic: str
+    partition: int
+    offset: int
+    value: Dict
+
+
+class KafkaDeliveryError(Exception):
+    pass
+
+
 class KafkaProducer:
     def __init__(self, host: str, port: int, user: str, password: str, topic: str, cert_path: str) -> None:
         params = {
@@ -18,14 +38,47 @@ class KafkaProducer:
             'sasl.username': user,
             'sasl.password': password,
             'error_cb': error_callback,
+            # даём librdkafka несколько миллисекунд собрать сообщения в один запрос к брокеру
+            'linger.ms': 5,
         }
 
         self.topic = topic
         self.p = Producer(params)
+        self._delivery_errors: List = []
+
+    def produce(self, payload: Dict, key: Optional[str] = None) -> None:
+        """
+        неблокирующая отправка: сообщение ставится в очередь librdkafka,
+        результат доставки приходит в _on_delivery.
+        Подтверждения всей пачки ждём одним вызовом flush() в конце обработки пачки.
+        key - ключ сообщения: сообщения с одним ключом попадают в одну партицию и читаются по порядку.
+        """
+        value = json_codec.dumps(payload)
+        try:
+            self.p.produce(self.topic, value, key=key, on_delivery=self._on_delivery)
+        except BufferError:
+            # локальная очередь переполнена - даём librdkafka отправить часть сообщений и пробуем ещё раз
+            self.p.poll(1)
+            self.p.produce(self.topic, value, key=key, on_delivery=self._on_delivery)
+        # обслуживаем колбэки уже доставленных сообщений, не блокируясь
+        self.p.poll(0)
 
-    def produce(self, payload: Dict) -> None:
-        self.p.produce(self.topic, json.dumps(payload))
-        self.p.flush(10)
+    def flush(self, timeout: float = 10) -> None:
+        """
+        дожидается доставки всех поставленных в очередь сообщений.
+        Если что-то не доставлено (ошибка брокера или не уложились в timeout) - KafkaDeliveryError.
+        """
+        remaining = self.p.flush(timeout)
+        errors = self._delivery_errors
+        self._delivery_errors = []
+        if remaining > 0:
+            errors.append(f'{remaining} message(s) still in queue after {timeout}s')
+        if errors:
+            raise KafkaDeliveryError(errors)
+
+    def _on_delivery(self, err, msg) -> None:
+        if err is not None:
+            self._delivery_errors.append(err)
 
 
 class KafkaConsumer:
@@ -49,19 +102,136 @@ class KafkaConsumer:
             'auto.offset.reset': 'earliest',
             'enable.auto.commit': False,
             'error_cb': error_callback,
+            'on_commit': commit_callback,
             'debug': 'all',
             'client.id': 'someclientkey'
         }
 
         self.topic = topic
+        # (topic, partition) -> следующий offset к чтению по уже обработанным сообщениям
+        self._processed_offsets: Dict[Tuple[str, int], int] = {}
         self.c = Consumer(params)
-        self.c.subscribe([topic])
-
-    def consume(self, timeout: float = 3.0) -> Optional[Dict]:
-        msg = self.c.poll(timeout=timeout)
-        if not msg:
-            return None
-        if msg.error():
-            raise Exception(msg.error())
-        val = msg.value().decode()
-        return json.loads(val)
+        self.c.subscribe([topic], on_revoke=self._on_revoke)
+
+    def consume_batch(self, num_messages: int = 100, timeout: float = 3.0) -> List[KafkaMessage]:
+        """
+        забирает до num_messages сообщений за один вызов (ждёт не дольше timeout секунд).
+        на выходе - list of KafkaMessage: декодированное сообщение + topic/partition/offset.
+        Если сообщений нет - пустой список.
+        Сообщение, которое не разбирается как json, пропускается с записью в лог
+        (и в processor_messages_skipped_total) - остальная пачка обрабатывается как обычно.
+        Если Kafka вернула ошибку - позиция чтения возвращается на начало опрошенной пачки
+        (consume() её уже сдвинул) и пробрасывается KafkaException.
+        """
+        batch = []
+        # опрос и декодирование замеряются отдельными этапами, не вложенными друг в друга
+        with processor_metrics.stage('kafka_poll'):
+            messages = self.c.consume(num_messages=num_messages, timeout=timeout)
+        with processor_metrics.stage('kafka_decode'):
+            for msg in messages:
+                if msg.error():
+                    self._seek(self._first_offsets(
+                        (m.topic(), m.partition(), m.offset()) for m in messages if not m.error()
+                    ))
+                    raise KafkaException(msg.error())
+                try:
+                    value = json_codec.loads(msg.value())
+                except (ValueError, TypeError) as e:
+                    print('Skipping undecodable message {}[{}]@{}: {}'.format(
+                        msg.topic(), msg.partition(), msg.offset(), e
+                    ))
+                    processor_metrics.message_skipped()
+                    continue
+                batch.append(KafkaMessage(msg.topic(), msg.partition(), msg.offset(), value))
+        return batch
+
+    def commit(self, messages: List[KafkaMessage], asynchronous: bool = True) -> None:
+        """
+        фиксирует оффсеты пачки, которая уже надёжно записана (PG) и отправлена дальше (Kafka):
+        по каждой партиции коммитится последний offset + 1.
+        По умолчанию commit асинхронный, ошибки пишутся в лог из commit_callback.
+        """
+        offsets = {}
+        for message in messages:
+            key = (message.topic, message.partition)
+            offsets[key] = max(offsets.get(key, 0), message.offset + 1)
+        if not offsets:
+            return
+        self._processed_offsets.update(offsets)
+        self._commit_offsets(offsets, asynchronous)
+
+    def rewind(self, messages: List[KafkaMessage]) -> None:
+        """
+        возвращает позицию чтения на первое сообщение пачки по каждой партиции -
+        для повторной обработки пачки, которую не удалось записать.
+        """
+        self._seek(self._first_offsets((m.topic, m.partition, m.offset) for m in messages))
+
+    def lag(self, timeout: float = 5.0) -> Dict[int, int]:
+        """
+        отставание по назначенным консьюмеру партициям: номер партиции -> сколько сообщений
+        осталось прочитать (high watermark минус текущая позиция чтения;
+        если партицию ещё не читали - минус закоммиченный оффсет группы, а нет и его - low watermark).
+        Watermark-и запрашиваются у брокера, так что вызывать не на каждую пачку.
+        """
+        partitions = self.c.assignment()
+        if not partitions:
+            return {}
+
+        committed = None
+        lags = {}
+        for tp in self.c.position(partitions):
+            low, high = self.c.get_watermark_offsets(tp, timeout=timeout, cached=False)
+            offset = tp.offset
+            if offset < 0:
+                if committed is None:
+                    committed = {c.partition: c.offset for c in self.c.committed(partitions, timeout=timeout)}
+                offset = committed.get(tp.partition, -1)
+            if offset < 0:
+                offset = low
+            lags[tp.partition] = max(high - offset, 0)
+        return lags
+
+    def close(self) -> None:
+        """
+        синхронно коммитит оффсеты всех обработанных сообщений
+        и выходит из consumer group (партиции сразу уходят другим участникам группы)
+        """
+        try:
+            self._commit_offsets(self._processed_offsets, asynchronous=False)
+        except KafkaException as e:
+            error_callback(e)
+        self.c.close()
+
+    @staticmethod
+    def _first_offsets(positions: Iterable[Tuple[str, int, int]]) -> Dict[Tuple[str, int], int]:
+        # (topic, partition, offset) -> наименьший offset по каждой партиции
+        offsets = {}
+        for topic, partition, offset in positions:
+            key = (topic, partition)
+            offsets[key] = min(offsets.get(key, offset), offset)
+        return offsets
+
+    def _seek(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        for (topic, partition), offset in offsets.items():
+            self.c.seek(TopicPartition(topic, partition, offset))
+
+    def _commit_offsets(self, offsets: Dict[Tuple[str, int], int], asynchronous: bool) -> None:
+        if not offsets:
+            return
+        self.c.commit(
+            offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+            asynchronous=asynchronous
+        )
+
+    def _on_revoke(self, consumer, partitions) -> None:
+        # партиции уходят другому участнику группы - дожимаем по ним commit синхронно
+        revoked = {}
+        for tp in partitions:
+            key = (tp.topic, tp.partition)
+            if key in self._processed_offsets:
+                revoked[key] = self._processed_offsets.pop(key)
+        try:
+            self._commit_offsets(revoked, asynchronous=False)
+        except KafkaException as e:
+            error_callback(e)
@@ -0,0 +1,70 @@
+import time
+from typing import Dict
+
+from confluent_kafka import KafkaException
+
+from .kafka_connectors import KafkaConsumer, error_callback
+
+
+class LagMonitor:
+    """
+    следит за отставанием консьюмера (KafkaConsumer.lag(), не чаще раза в check_interval секунд)
+    и по нему подбирает режим чтения:
+    отставание от high_lag и больше - пачки max_batch_size и короткий опрос (сообщения точно есть),
+    отставания нет - пачки min_batch_size и обычный опрос poll_timeout (дальше - idle-пауза ProcessorRunner),
+    между ними размер пачки растёт линейно.
+    """
+
+    def __init__(self,
+                 consumer: KafkaConsumer,
+                 min_batch_size: int = 10,
+                 max_batch_size: int = 500,
+                 high_lag: int = 5000,
+                 check_interval: float = 5.0,
+                 poll_timeout: float = 1.0,
+                 busy_poll_timeout: float = 0.1
+                 ) -> None:
+        self._consumer = consumer
+        self._min_batch_size = min_batch_size
+        self._max_batch_size = max(max_batch_size, min_batch_size)
+        self._high_lag = max(high_lag, 1)
+        self._check_interval = check_interval
+        self._poll_timeout = poll_timeout
+        self._busy_poll_timeout = busy_poll_timeout
+        self._lag: Dict[int, int] = {}
+        self._checked_at = None
+
+    @property
+    def lag(self) -> Dict[int, int]:
+        """последнее известное отставание: партиция -> сообщений"""
+        return dict(self._lag)
+
+    @property
+    def total_lag(self) -> int:
+        return sum(self._lag.values())
+
+    def update(self) -> bool:
+        """
+        перезапрашивает отставание, если с прошлого раза прошло check_interval;
+        на выходе - обновилось ли отставание
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self._check_interval:
+            return False
+        self._checked_at = now
+        try:
+            self._lag = self._consumer.lag()
+        except KafkaException as e:
+            # брокер не ответил - работаем по последнему известному отставанию
+            error_callback(e)
+            return False
+        return True
+
+    def batch_size(self) -> int:
+        share = min(self.total_lag / self._high_lag, 1.0)
+        return int(self._min_batch_size + (self._max_batch_size - self._min_batch_size) * share)
+
+    def poll_timeout(self) -> float:
+        if self.total_lag >= self._high_lag:
+            return self._busy_poll_timeout
+        return self._poll_timeout
@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Generator, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from .stage_profiler import profiler
+
+# метрики процесса сервиса (общие для всех воркеров), отдаются Flask-ом на /metrics
+
+MESSAGES_PROCESSED = Counter(
+    'processor_messages_processed_total',
+    'Сообщения, обработанные и закоммиченные обработчиком (сообщений в секунду - rate())'
+)
+BATCH_SIZE = Histogram(
+    'processor_batch_size',
+    'Размер пачки сообщений, прочитанной из Kafka',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+MESSAGES_SKIPPED = Counter(
+    'processor_messages_skipped_total',
+    'Сообщения, пропущенные без обработки (не хватает данных или падают при каждой попытке)'
+)
+STAGE_DURATION = Histogram(
+    'processor_stage_duration_seconds',
+    'Время этапа обработки пачки (опрос Kafka, Redis, upsert-ы в PG, запросы счётчиков, produce/flush)',
+    ['stage'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+STAGE_ERRORS = Counter(
+    'processor_stage_errors_total',
+    'Исключения, вылетевшие из этапа обработки',
+    ['stage']
+)
+CONSUMER_LAG = Gauge(
+    'processor_consumer_lag',
+    'Отставание консьюмера: сколько сообщений партиции исходного топика ещё не прочитано',
+    ['partition']
+)
+
+
+@contextmanager
+def stage(name: str) -> Generator[None, None, None]:
+    """
+    замеряет время блока в STAGE_DURATION{stage=name}; исключение из блока считается в STAGE_ERRORS.
+    Если текущий run() попал в выборку профайлера - время этапа идёт и в него.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.labels(name).observe(elapsed)
+        profiler.record(name, elapsed)
+
+
+def batch_done(size: int) -> None:
+    """пачка из size сообщений обработана и закоммичена"""
+    BATCH_SIZE.observe(size)
+    MESSAGES_PROCESSED.inc(size)
+    profiler.messages(size)
+
+
+def message_skipped(count: int = 1) -> None:
+    """count сообщений пропущено без обработки"""
+    MESSAGES_SKIPPED.inc(count)
+
+
+def consumer_lag(lags: Dict[int, int]) -> None:
+    """последнее измеренное отставание по партициям"""
+    for partition, lag in lags.items():
+        CONSUMER_LAG.labels(str(partition)).set(lag)
+
+
+def exposition() -> Tuple[bytes, str]:
+    """текст метрик в формате Prometheus и его Content-Type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
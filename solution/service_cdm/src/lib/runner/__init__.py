@@ -0,0 +1,2 @@
+from .processor_pool import ProcessorPool  # noqa
+from .processor_runner import ProcessorRunner  # noqa
@@ -0,0 +1,97 @@
+import threading
+import time
+from logging import Logger
+from typing import Callable, Optional
+
+from lib.metrics.stage_profiler import profiler
+
+
+class ProcessorRunner:
+    """
+    крутит run() процессора в отдельном потоке: пока run() возвращает непустые пачки,
+    следующая пачка забирается сразу, без пауз.
+    Если пачка пустая (или run() упал), поток ждёт idle-паузу, которая растёт вдвое
+    от idle_backoff_min до idle_backoff_max и сбрасывается первой же непустой пачкой.
+    stop() дорабатывает текущую пачку, вызывает on_stop и дожидается завершения потока.
+    Ошибки run() ловятся, и поток продолжает работать, поэтому живой поток ещё не значит
+    рабочий воркер: is_healthy() учитывает и неудачи run() подряд (не больше max_failures),
+    и время с последнего успешного run() (не больше max_silence секунд).
+    """
+
+    def __init__(self,
+                 run: Callable[[], int],
+                 logger: Logger,
+                 idle_backoff_min: float = 0.1,
+                 idle_backoff_max: float = 5.0,
+                 on_stop: Optional[Callable[[], None]] = None,
+                 name: str = 'processor-runner',
+                 max_failures: int = 10,
+                 max_silence: float = 120.0
+                 ) -> None:
+        self._run = run
+        self._logger = logger
+        self._idle_backoff_min = idle_backoff_min
+        self._idle_backoff_max = idle_backoff_max
+        self._on_stop = on_stop
+        self._max_failures = max_failures
+        self._max_silence = max_silence
+        # неудачные run() подряд и время (monotonic) последнего успешного run()
+        self._failures = 0
+        self._last_success = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+
+    @property
+    def name(self) -> str:
+        return self._thread.name
+
+    def start(self) -> None:
+        self._last_success = time.monotonic()
+        self._thread.start()
+
+    def request_stop(self) -> None:
+        """просит поток остановиться после текущей пачки, не дожидаясь его"""
+        self._stop_event.set()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self.request_stop()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def is_healthy(self) -> bool:
+        """поток жив, и run() не падает раз за разом и не висит дольше max_silence секунд"""
+        return (
+            self._thread.is_alive()
+            and self._failures < self._max_failures
+            and time.monotonic() - self._last_success <= self._max_silence
+        )
+
+    def _loop(self) -> None:
+        backoff = self._idle_backoff_min
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    with profiler.run():
+                        processed = self._run()
+                    self._failures = 0
+                    self._last_success = time.monotonic()
+                except Exception:
+                    self._failures += 1
+                    self._logger.exception(f"{self._thread.name}: run failed ({self._failures} in a row)")
+                    processed = 0
+
+                if processed:
+                    backoff = self._idle_backoff_min
+                    continue
+
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self._idle_backoff_max)
+        finally:
+            if self._on_stop is not None:
+                try:
+                    self._on_stop()
+                except Exception:
+                    self._logger.exception(f"{self._thread.name}: shutdown failed")
@@ -1,34 +1,100 @@
 import logging
+import signal
+import sys
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, jsonify, request
 
 from app_config import AppConfig
 from dds_loader.dds_message_processor_job import DdsMessageProcessor
 from dds_loader.repository.dds_repository import DdsRepository
+from lib.metrics import processor_metrics
+from lib.metrics.stage_profiler import profiler
+from lib.runner import ProcessorPool
+
 
 app = Flask(__name__)
 
 config = AppConfig()
 
+workers: ProcessorPool = None
+
 
 @app.get('/health')
 def hello_world():
+    if workers is not None and not workers.is_alive():
+        return 'unhealthy', 503
     return 'healthy'
 
 
+# метрики в формате Prometheus
+@app.get('/metrics')
+def metrics():
+    body, content_type = processor_metrics.exposition()
+    return body, 200, {'Content-Type': content_type}
+
+
+# отставание консьюмеров от конца исходного топика: воркер -> {партиция: сообщений}
+@app.get('/lag')
+def lag():
+    if workers is None:
+        return jsonify({})
+    return jsonify({
+        name: {str(partition): value for partition, value in proc.lag().items()}
+        for name, proc in workers.processors().items()
+    })
+
+
+# Разбивка времени обработки по этапам (по выборке запусков обработчика, PROFILE_SAMPLE_RATE):
+# ?reset=1 - сбросить накопленное, ?cprofile=N - снять cProfile воркеров за N секунд (не больше 60).
+@app.get('/debug/profile')
+def debug_profile():
+    cprofile_seconds = request.args.get('cprofile', type=float)
+    if cprofile_seconds is not None:
+        stats = profiler.capture_cprofile(min(max(cprofile_seconds, 0.0), 60.0))
+        if stats is None:
+            return 'cprofile capture already running', 409
+        return stats, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    snapshot = profiler.snapshot()
+    if request.args.get('reset'):
+        profiler.reset()
+    return jsonify(snapshot)
+
+
 if __name__ == '__main__':
     app.logger.setLevel(logging.DEBUG)
+    profiler.sample_rate = config.profile_sample_rate
+
+    # схему дорабатываем один раз при старте, до запуска воркеров
+    schema_db = config.pg_warehouse_db()
+    DdsRepository(schema_db).init_schema()
+    schema_db.close()
+
+    # у каждого воркера свои consumer (в общей группе), producer и пул подключений к PG
+    def make_processor(worker: int) -> DdsMessageProcessor:
+        consumer = config.kafka_consumer()
+        return DdsMessageProcessor(
+            consumer,
+            config.kafka_producer(),
+            DdsRepository(config.pg_warehouse_db()),
+            config.lag_monitor(consumer),
+            app.logger,
+            config.seen_keys_size
+        )
 
-    proc = DdsMessageProcessor(
-        config.kafka_consumer(),
-        config.kafka_producer(),
-        DdsRepository(config.pg_warehouse_db()),
-        app.logger
+    workers = ProcessorPool(
+        make_processor,
+        config.processor_workers,
+        app.logger,
+        config.idle_backoff_min,
+        config.idle_backoff_max,
+        name='dds-processor'
     )
+    workers.start()
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=25)
-    scheduler.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-    app.run(debug=True, host='0.0.0.0', use_reloader=False)
+    try:
+        app.run(debug=True, host='0.0.0.0', use_reloader=False)
+    finally:
+        workers.stop()
@@ -1,10 +1,19 @@
-import uuid
 from datetime import datetime
 from logging import Logger
+from typing import Dict, List
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
+import psycopg
+from confluent_kafka import KafkaException
+
+from lib.kafka_connect import BatchRetry, KafkaConsumer, KafkaDeliveryError, KafkaMessage, KafkaProducer, LagMonitor
+from lib.metrics import processor_metrics
 from lib.pg import PgConnect
+from dds_loader.dds_vault_batch import DdsVaultBatch
 from dds_loader.repository.dds_repository import DdsRepository
+from dds_loader.seen_key_cache import SeenKeyCache
+
+# недоступность PG или Kafka: такие пачки повторяем, пока не получится, а не пропускаем
+_TRANSIENT_ERRORS = (psycopg.OperationalError, KafkaDeliveryError, KafkaException)
 
 
 class DdsMessageProcessor:
@@ -12,29 +21,85 @@ class DdsMessageProcessor:
     _kafka_producer: KafkaProducer = None
     _dds_repository: DdsRepository = None
     _logger: Logger = None
-    _batch_size: int = 30
+    _lag_monitor: LagMonitor = None
+    _batch_retry: BatchRetry = None
+    _seen_keys: SeenKeyCache = None
+    _seen_keys_size: int = 50000
+    _seen_keys_warmed_up: bool = False
 
     def __init__(self,
                  kafka_consumer: KafkaConsumer,
                  kafka_producer: KafkaProducer,
                  dds_repository: DdsRepository,
-                 logger: Logger) -> None:
+                 lag_monitor: LagMonitor,
+                 logger: Logger,
+                 seen_keys_size: int = 50000) -> None:
 
         self._kafka_consumer = kafka_consumer
         self._kafka_producer = kafka_producer
         self._dds_repository = dds_repository
+        self._lag_monitor = lag_monitor
+        self._batch_retry = BatchRetry(kafka_consumer, logger, transient_errors=_TRANSIENT_ERRORS)
         self._logger = logger
-        # forced
-        self._batch_size = 30
+        # ключи хабов и линков, которые уже есть в dds - их upsert пропускаем
+        self._seen_keys_size = seen_keys_size
+        self._seen_keys = SeenKeyCache(seen_keys_size)
+        self._seen_keys_warmed_up = False
+
+    def run(self) -> int:
+        """
+        обрабатывает одну пачку сообщений; вызывается в цикле из ProcessorRunner.
+        на выходе - количество обработанных сообщений (0 - в Kafka пусто).
+        """
+
+        # Step 1. Получаем пачку сообщений из Kafka с помощью `consume_batch()`.
+        # размер пачки и таймаут опроса - по отставанию консьюмера
+        if self._lag_monitor.update():
+            processor_metrics.consumer_lag(self._lag_monitor.lag)
+        # время опроса Kafka (kafka_poll) и декодирования (kafka_decode) замеряет сам consume_batch
+        messages = self._kafka_consumer.consume_batch(
+            self._lag_monitor.batch_size(),
+            timeout=self._lag_monitor.poll_timeout()
+        )
+        if not messages:
+            return 0
+
+        self._logger.info(f"{datetime.utcnow()}: START, {len(messages)} messages")
+
+        # если пачка не записалась, BatchRetry возвращает позицию чтения на её начало,
+        # чтобы следующий run() прочитал её заново, а не закоммитил оффсеты поверх;
+        # сообщения, которые падают при каждой попытке, после нескольких повторов пропускаются
+        self._batch_retry.process(messages, self._process_batch)
+
+        # Step 15. Пачка записана в PG и доставлена в Kafka - фиксируем оффсеты.
+        with processor_metrics.stage('kafka_commit'):
+            self._kafka_consumer.commit(messages)
+        processor_metrics.batch_done(len(messages))
+
+        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        return len(messages)
+
+    def close(self) -> None:
+        self._kafka_consumer.close()
 
-    def run(self) -> None:
-        self._logger.info(f"{datetime.utcnow()}: START")
+    def lag(self) -> Dict[int, int]:
+        """последнее известное отставание консьюмера: партиция -> сообщений"""
+        return self._lag_monitor.lag
 
-        processed_messages = 0;
-        timeout: float = 3.0
-        while processed_messages < self._batch_size:
-            # Step 1. Получаем сообщение из Kafka с помощью `consume()`.
-            dct_msg = self._kafka_consumer.consume(timeout=timeout)
+    def _process_batch(self, messages: List[KafkaMessage]) -> None:
+        # источник у нас один - это мы и есть,
+        # согласно предложению в уроке будет "orders-system-kafka"
+        load_src = "orders-system-kafka"
+
+        # load_dt
+        # с таймстемпами в постгресе "всё сложно",
+        # но раз в уроках велели создать обычные timestamp-поля,
+        # то вместо now() юзаем utcnow() (?)
+        load_dt = datetime.utcnow()
+
+        vault_batch = DdsVaultBatch(load_dt, load_src)
+        for message in messages:
+            dct_msg = message.value
             # message example (пример реализованного контракта)
             # {
             # 'object_id': 1027424,
@@ -72,188 +137,93 @@ class DdsMessageProcessor:
             if dct_msg['object_type'] != 'order':
                 continue
 
-            # источник у нас один - это мы и есть,
-            # согласно предложению в уроке будет "orders-system-kafka"
-            load_src = "orders-system-kafka"
-
-            # load_dt
-            # с таймстемпами в постгресе "всё сложно",
-            # но раз в уроках велели создать обычные timestamp-поля,
-            # то вместо now() юзаем utcnow() (?)
-            load_dt = datetime.utcnow()
-
-            # Step 2. upsert dds.h_order, s_order_cost, s_order_status
-            order_id = dct_msg['payload']['id']
-            h_order_pk = uuid.uuid3(uuid.NAMESPACE_X500, str(order_id))
-            order_dt = dct_msg['payload']['date']
-            order_cost = dct_msg['payload']['cost']
-            order_payment = dct_msg['payload']['payment']
-            order_status = dct_msg['payload']['status']
-            self._dds_repository.order_upsert(
-                h_order_pk, order_id, order_dt,
-                order_cost, order_payment, order_status,
-                load_dt, load_src
-            )
-
-            # Step 3. upsert h_user, s_user_names
-            user_id = dct_msg['payload']['user']['id']
-            h_user_pk = uuid.uuid3(uuid.NAMESPACE_X500, user_id)
-            username = dct_msg['payload']['user']['name']
-            userlogin = username
-            if 'login' in dct_msg['payload']['user']:
-                userlogin = dct_msg['payload']['user']['login']
-            self._dds_repository.user_upsert(
-                h_user_pk, user_id, username, userlogin,
-                load_dt, load_src
-            )
-
-            # Step 4. upsert h_restaurant, s_restaurant_names
-            restaurant_id = dct_msg['payload']['restaurant']['id']
-            h_restaurant_pk = uuid.uuid3(uuid.NAMESPACE_X500, restaurant_id)
-            restaurant_name = dct_msg['payload']['restaurant']['name']
-            self._dds_repository.restaurant_upsert(
-                h_restaurant_pk, restaurant_id, restaurant_name,
-                load_dt, load_src
-            )
-
-            # prepare products and categories
-            upsert_products = {}
-            upsert_categories = {}
-            for next_product in dct_msg['payload']['products']:
-                next_category = next_product['category']
-                upsert_categories[next_category] = next_category
-                next_product_id = next_product['id']
-                next_product_name = next_product['name']
-                upsert_products[next_product_id] = next_product_name
-
-            # Step 5. upsert h_category
-            for next_category in upsert_categories:
-                h_category_pk = uuid.uuid3(uuid.NAMESPACE_X500, next_category)
-                self._dds_repository.category_upsert(
-                    h_category_pk, next_category, load_dt, load_src)
-
-            # Step 6. upsert h_product, s_product_names
-            for next_product_id in upsert_products:
-                next_product_name = upsert_products[next_product_id]
-                h_product_pk = uuid.uuid3(uuid.NAMESPACE_X500, next_product_id)
-                self._dds_repository.product_upsert(
-                    h_product_pk, next_product_id, next_product_name,
-                    load_dt, load_src
+            # Steps 2-10. Раскладываем заказ по строкам хабов, линков и сателлитов пачки
+            # (h_order, s_order_cost, s_order_status, h_user, s_user_names, h_restaurant,
+            # s_restaurant_names, h_category, h_product, s_product_names, l_product_category,
+            # l_product_restaurant, l_order_product, l_order_user).
+            with processor_metrics.stage('vault_batch_build'):
+                vault_batch.add_order(dct_msg)
+
+        if not len(vault_batch):
+            return
+
+        # хабы и линки, которые уже точно записаны, повторно не апсертим
+        if not self._seen_keys_warmed_up:
+            self._warm_up_seen_keys()
+        vault_batch.drop_seen(self._seen_keys)
+
+        out_messages = []
+        with self._dds_repository.unit_of_work():
+            # Steps 2-10. upsert всей пачки: по одному запросу на таблицу, в одной транзакции
+            inserted_keys = self._dds_repository.vault_batch_upsert(vault_batch)
+
+            # счётчики заказов прибавляем только по реально вставленным линкам заказ-продукт,
+            # так что повторно прочитанный заказ их не меняет
+            product_deltas, category_deltas = vault_batch.counter_deltas(inserted_keys['l_order_product'])
+            with processor_metrics.stage('pg_counters_increment'):
+                self._dds_repository.counters_increment(product_deltas, category_deltas)
+
+            # Steps 11-12. Счётчики для cdm-сервиса: сразу по всем парам (пользователь, продукт)
+            # и (пользователь, категория) пачки, по одному запросу на вид счётчика.
+            # Значения выбираются после всех инкрементов пачки, т.е. уже итоговые.
+            with processor_metrics.stage('pg_counter_query_product'):
+                users_product_counters = self._dds_repository.get_users_product_counters(
+                    (h_user_pk, h_product_pk)
+                    for h_user_pk, dict_product_pk, _ in vault_batch.orders for h_product_pk in dict_product_pk
                 )
-
-            # для наглядности отдельный цикл с повторным формированием uuid и т. п.
-            #
-            # сюда сложим pk всех продуктов для дальнейшего использования
-            # в Step 11. Сообщения для cdm-сервиса, а именно для заполнения cdm.user_product_counters
-            dict_product_pk = {}
-            # сюда сложим pk всех категорий для дальнейшего использования
-            # в Step 12. Сообщения для cdm-сервиса, а именно для заполненияcdm.user_category_counters
-            dict_category_pk = {}
-            for next_product in dct_msg['payload']['products']:
-                next_product_id = next_product['id']
-                h_product_pk = uuid.uuid3(uuid.NAMESPACE_X500, next_product_id)
-                dict_product_pk[h_product_pk] = h_product_pk  # for Step 11
-
-                next_category = next_product['category']
-                h_category_pk = uuid.uuid3(uuid.NAMESPACE_X500, next_category)
-                dict_category_pk[h_category_pk] = h_category_pk  # for Step 12
-
-                # Step 7. upsert l_product_category
-                hk_product_category_pk = uuid.uuid3(
-                    uuid.NAMESPACE_X500,
-                    str(h_product_pk) + '/' + str(h_category_pk)
-                )
-                self._dds_repository.l_product_category_upsert(
-                    hk_product_category_pk,
-                    h_product_pk, h_category_pk,
-                    load_dt, load_src
+            with processor_metrics.stage('pg_counter_query_category'):
+                users_category_counters = self._dds_repository.get_users_category_counters(
+                    (h_user_pk, h_category_pk)
+                    for h_user_pk, _, dict_category_pk in vault_batch.orders for h_category_pk in dict_category_pk
                 )
 
-                # Step 8. upsert l_product_restaurant
-                # h_restaurant_pk - see Step 4 above
-                # h_product_pk - see Step 7 above
-                hk_product_restaurant_pk = uuid.uuid3(
-                    uuid.NAMESPACE_X500,
-                    str(h_product_pk) + '/' + str(h_restaurant_pk)
-                )
-                self._dds_repository.l_product_restaurant_upsert(
-                    hk_product_restaurant_pk,
-                    h_product_pk, h_restaurant_pk,
-                    load_dt, load_src
-                )
-
-                # Step 9. upsert l_order_product
-                # h_order_pk - see Step 2 above
-                # h_product_pk - see Step 7 above
-                hk_order_product_pk = uuid.uuid3(
-                    uuid.NAMESPACE_X500,
-                    str(h_order_pk) + '/' + str(h_product_pk)
-                )
-                self._dds_repository.l_order_product_upsert(
-                    hk_order_product_pk,
-                    h_order_pk, h_product_pk,
-                    load_dt, load_src
-                )
-
-            # Step 10. upsert l_order_user
-            # h_order_pk - see Step 2 above
-            # h_user_pk - see Step 3 above
-            hk_order_user_pk = uuid.uuid3(
-                uuid.NAMESPACE_X500,
-                str(h_order_pk) + '/' + str(h_user_pk)
-            )
-            self._dds_repository.l_order_user_upsert(
-                hk_order_user_pk,
-                h_order_pk, h_user_pk,
-                load_dt, load_src
-            )
-
-            # Step 11. Сообщения для cdm-сервиса, а именно для заполнения cdm.user_product_counters
-            # (счётчик заказов посетителя по продуктам (блюдам)).
-            # Я думаю, делать надо так: агрегирую данные для пользователя и продуктов,
-            # которые поучаствовали в данном заказе (то есть данные в БД были изменены),
-            # и отправляю сообщение, а в нём в payload/counters: list,
-            # указывая тип сообщения (object_type) для обработчика - 'user_product_counters'.
-            # Далее cdm-service тоже будет не инкрементить, а тупо апсертить данные в витрины,
-            # после отработки каждого заказа, так надёжнее.
-            list_dicts_product_counters = self._dds_repository.get_user_product_counters(h_user_pk, dict_product_pk)
-            random_uuid = uuid.uuid4()
-            msg_type = 'user_product_counters'
-            msg = {
-                'object_id': str(random_uuid),
-                'object_type': msg_type,
-                'payload': {
-                    'id': str(random_uuid),
-                    "counters": list_dicts_product_counters
-                }
+            # одно сообщение на пользователя пачки, сколько бы заказов он ни сделал
+            h_user_pks = {str(h_user_pk) for h_user_pk, _, _ in vault_batch.orders}
+            for h_user_pk in sorted(h_user_pks):
+                out_messages.append(self._user_counters_message(
+                    h_user_pk,
+                    users_product_counters.get(h_user_pk, []),
+                    users_category_counters.get(h_user_pk, [])
+                ))
+
+        # транзакция закоммичена - ключи пачки теперь точно есть в dds
+        self._seen_keys.update(vault_batch.seen_keys())
+
+        # сообщения для cdm-сервиса отправляем только после commit-а;
+        # ключ - h_user_pk, так что сообщения одного пользователя cdm читает по порядку
+        for msg in out_messages:
+            with processor_metrics.stage('kafka_produce'):
+                self._kafka_producer.produce(msg, key=msg['object_id'])
+
+        # Step 14. Дожидаемся доставки всех сообщений пачки одним flush.
+        # Недоставленные сообщения всплывают здесь как KafkaDeliveryError.
+        with processor_metrics.stage('kafka_flush'):
+            self._kafka_producer.flush()
+
+    def _warm_up_seen_keys(self) -> None:
+        """заполняет кэш записанных ключей последними загруженными хабами и линками"""
+        per_table_limit = self._seen_keys_size // len(DdsVaultBatch.SEEN_KEY_TABLES)
+        for table in DdsVaultBatch.SEEN_KEY_TABLES:
+            keys = self._dds_repository.get_recent_keys(table, per_table_limit)
+            self._seen_keys.update((table, key) for key in keys)
+        self._seen_keys_warmed_up = True
+        self._logger.info(f"{datetime.utcnow()}: seen keys cache warmed up, {len(self._seen_keys)} keys")
+
+    def _user_counters_message(self, h_user_pk: str,
+                               product_counters: List[dict],
+                               category_counters: List[dict]) -> dict:
+        """
+        сообщение для cdm-сервиса 'user_counters' - все изменённые пачкой счётчики пользователя:
+        по продуктам (для cdm.user_product_counters) и по категориям (для cdm.user_category_counters).
+        cdm-сервис не инкрементит, а апсертит пришедшие значения в витрины.
+        """
+
+        return {
+            'object_id': h_user_pk,
+            'object_type': 'user_counters',
+            'payload': {
+                'id': h_user_pk,
+                'product_counters': product_counters,
+                'category_counters': category_counters
             }
-            self._kafka_producer.produce(msg)
-
-            # Step 12. Сообщения для cdm-сервиса, а именно для заполненияcdm.user_category_counters
-            # (счётчик заказов посетителя по категориям товаров).
-            # Я думаю, делать надо так: агрегирую данные для пользователя и категорий,
-            # которые поучаствовали в данном заказе (то есть данные в БД были изменены),
-            # и отправляю сообщение, а в нём в payload/counters: list,
-            # указывая тип сообщения (object_type) для обработчика - 'user_category_counters'.
-            # Далее cdm-service тоже будет не инкрементить, а тупо апсертить данные в витрины,
-            # после отработки каждого заказа, так надёжнее.
-            list_dicts_category_counters = self._dds_repository.get_user_category_counters(h_user_pk, dict_category_pk)
-            random_uuid = uuid.uuid4()
-            msg_type = 'user_category_counters'
-            msg = {
-                'object_id': str(random_uuid),
-                'object_type': msg_type,
-                'payload': {
-                    'id': str(random_uuid),
-                    "counters": list_dicts_category_counters
-                }
-            }
-            self._kafka_producer.produce(msg)
-
-            # Step 13. Чистимся.
-            # не знаю, ндо ли в питоне следить за этим,
-            # но всё же мы резидентом висим в контейнере...
-            del dct_msg, msg, list_dicts_product_counters, list_dicts_category_counters, \
-                dict_product_pk, dict_category_pk, upsert_products, upsert_categories
-
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        }
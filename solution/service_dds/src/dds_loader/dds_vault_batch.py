@@ -0,0 +1,168 @@
+import uuid
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from dds_loader.hash_keys import HashKeyGenerator, hash_keys
+from dds_loader.seen_key_cache import SeenKeyCache
+
+
+class DdsVaultBatch:
+    """
+    строки хабов, линков и сателлитов для пачки заказов, разложенные по таблицам dds.
+    В каждой таблице строки дедуплицированы по первичному ключу (последняя побеждает),
+    так что пачка пишется одним multi-row upsert-ом на таблицу (см. DdsRepository.vault_batch_upsert).
+    Кроме строк, для каждого заказа запоминаются пользователь, его продукты и категории -
+    по ним потом собираются счётчики для cdm-сервиса.
+    """
+
+    # хабы и линки, строки которых однозначно определяются ключом:
+    # если ключ уже записан, их upsert можно пропустить целиком
+    SEEN_KEY_TABLES: Tuple[str, ...] = (
+        'h_product', 'h_category', 'h_restaurant', 'l_product_category', 'l_product_restaurant'
+    )
+
+    def __init__(self, load_dt: datetime, load_src: str, keys: HashKeyGenerator = hash_keys) -> None:
+        self.load_dt = load_dt
+        self.load_src = load_src
+        self._keys = keys
+
+        # хабы и сателлиты: pk -> кортеж значений колонок (порядок - как в DdsRepository),
+        # последняя колонка сателлита - hashdiff его атрибутов
+        self.h_order: Dict[uuid.UUID, Tuple] = {}
+        self.s_order_cost: Dict[uuid.UUID, Tuple] = {}
+        self.s_order_status: Dict[uuid.UUID, Tuple] = {}
+        self.h_user: Dict[uuid.UUID, Tuple] = {}
+        self.s_user_names: Dict[uuid.UUID, Tuple] = {}
+        self.h_restaurant: Dict[uuid.UUID, Tuple] = {}
+        self.s_restaurant_names: Dict[uuid.UUID, Tuple] = {}
+        self.h_category: Dict[uuid.UUID, Tuple] = {}
+        self.h_product: Dict[uuid.UUID, Tuple] = {}
+        self.s_product_names: Dict[uuid.UUID, Tuple] = {}
+
+        # линки
+        self.l_product_category: Dict[uuid.UUID, Tuple] = {}
+        self.l_product_restaurant: Dict[uuid.UUID, Tuple] = {}
+        self.l_order_product: Dict[uuid.UUID, Tuple] = {}
+        self.l_order_user: Dict[uuid.UUID, Tuple] = {}
+
+        # по каждому заказу: (h_user_pk, dict_product_pk, dict_category_pk)
+        self.orders: List[Tuple[uuid.UUID, dict, dict]] = []
+
+        # состав заказов для инкремента счётчиков:
+        # h_order_pk -> (h_user_pk, [(hk_order_product_pk, h_product_pk, h_category_pk), ...])
+        self.order_items: Dict[uuid.UUID, Tuple[uuid.UUID, List[Tuple[uuid.UUID, uuid.UUID, uuid.UUID]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def drop_seen(self, seen_keys: SeenKeyCache) -> None:
+        """выкидывает из SEEN_KEY_TABLES строки, ключи которых уже записаны в dds"""
+        for table in self.SEEN_KEY_TABLES:
+            rows = getattr(self, table)
+            for pk in [pk for pk in rows if (table, pk) in seen_keys]:
+                del rows[pk]
+
+    def seen_keys(self) -> List[Tuple[str, uuid.UUID]]:
+        """ключи (таблица, pk) строк SEEN_KEY_TABLES - после commit-а их можно считать записанными"""
+        return [(table, pk) for table in self.SEEN_KEY_TABLES for pk in getattr(self, table)]
+
+    def counter_deltas(self, new_order_product_pks: Set[uuid.UUID]) -> Tuple[Dict[tuple, int], Dict[tuple, int]]:
+        """
+        приращения счётчиков заказов (пользователь, продукт) и (пользователь, категория)
+        по линкам l_order_product, которые реально вставлены этой пачкой.
+        Заказ добавляет единицу к продукту, если его линк с продуктом новый,
+        и к категории, если в заказе не было уже записанных линков с продуктами этой категории.
+        """
+        product_deltas: Dict[tuple, int] = defaultdict(int)
+        category_deltas: Dict[tuple, int] = defaultdict(int)
+
+        for h_user_pk, items in self.order_items.values():
+            new_products = set()
+            new_categories = set()
+            old_categories = set()
+            for hk_order_product_pk, h_product_pk, h_category_pk in items:
+                if hk_order_product_pk in new_order_product_pks:
+                    new_products.add(h_product_pk)
+                    new_categories.add(h_category_pk)
+                else:
+                    old_categories.add(h_category_pk)
+
+            for h_product_pk in new_products:
+                product_deltas[(h_user_pk, h_product_pk)] += 1
+            for h_category_pk in new_categories - old_categories:
+                category_deltas[(h_user_pk, h_category_pk)] += 1
+
+        return product_deltas, category_deltas
+
+    def add_order(self, dct_msg: dict) -> None:
+        payload = dct_msg['payload']
+        keys = self._keys
+
+        # h_order, s_order_cost, s_order_status:
+        # ключ заказа и hashdiff его стоимости у каждого заказа свои - их не мемоизируем
+        order_id = payload['id']
+        h_order_pk = keys.hub_key(order_id, memoize=False)
+        self.h_order[h_order_pk] = (h_order_pk, order_id, payload['date'])
+        self.s_order_cost[h_order_pk] = (
+            h_order_pk, h_order_pk, payload['cost'], payload['payment'],
+            keys.hashdiff(payload['cost'], payload['payment'], memoize=False)
+        )
+        self.s_order_status[h_order_pk] = (h_order_pk, h_order_pk, payload['status'], keys.hashdiff(payload['status']))
+
+        # h_user, s_user_names
+        user_id = payload['user']['id']
+        h_user_pk = keys.hub_key(user_id)
+        username = payload['user']['name']
+        userlogin = payload['user'].get('login', username)
+        self.h_user[h_user_pk] = (h_user_pk, user_id)
+        self.s_user_names[h_user_pk] = (h_user_pk, h_user_pk, username, userlogin, keys.hashdiff(username, userlogin))
+
+        # h_restaurant, s_restaurant_names
+        restaurant_id = payload['restaurant']['id']
+        h_restaurant_pk = keys.hub_key(restaurant_id)
+        self.h_restaurant[h_restaurant_pk] = (h_restaurant_pk, restaurant_id)
+        restaurant_name = payload['restaurant']['name']
+        self.s_restaurant_names[h_restaurant_pk] = (
+            h_restaurant_pk, h_restaurant_pk, restaurant_name, keys.hashdiff(restaurant_name)
+        )
+
+        # l_order_user
+        hk_order_user_pk = keys.link_key(h_order_pk, h_user_pk, memoize=False)
+        self.l_order_user[hk_order_user_pk] = (hk_order_user_pk, h_order_pk, h_user_pk)
+
+        # h_category, h_product, s_product_names и линки продукта:
+        # ключи хабов и повторяющихся линков продукта - сразу для всех продуктов заказа
+        products = payload['products']
+        h_product_pks = keys.hub_keys(product['id'] for product in products)
+        h_category_pks = keys.hub_keys(product['category'] for product in products)
+        hk_product_category_pks = keys.link_keys(zip(h_product_pks, h_category_pks))
+        hk_product_restaurant_pks = keys.link_keys((h_product_pk, h_restaurant_pk) for h_product_pk in h_product_pks)
+
+        dict_product_pk = {}
+        dict_category_pk = {}
+        order_items = []
+        for next_product, h_product_pk, h_category_pk, hk_product_category_pk, hk_product_restaurant_pk in zip(
+                products, h_product_pks, h_category_pks, hk_product_category_pks, hk_product_restaurant_pks
+        ):
+            dict_product_pk[h_product_pk] = h_product_pk
+            self.h_product[h_product_pk] = (h_product_pk, next_product['id'])
+            self.s_product_names[h_product_pk] = (
+                h_product_pk, h_product_pk, next_product['name'], keys.hashdiff(next_product['name'])
+            )
+
+            dict_category_pk[h_category_pk] = h_category_pk
+            self.h_category[h_category_pk] = (h_category_pk, next_product['category'])
+
+            self.l_product_category[hk_product_category_pk] = (hk_product_category_pk, h_product_pk, h_category_pk)
+
+            self.l_product_restaurant[hk_product_restaurant_pk] = (
+                hk_product_restaurant_pk, h_product_pk, h_restaurant_pk
+            )
+
+            hk_order_product_pk = keys.link_key(h_order_pk, h_product_pk, memoize=False)
+            self.l_order_product[hk_order_product_pk] = (hk_order_product_pk, h_order_pk, h_product_pk)
+            order_items.append((hk_order_product_pk, h_product_pk, h_category_pk))
+
+        self.orders.append((h_user_pk, dict_product_pk, dict_category_pk))
+        self.order_items[h_order_pk] = (h_user_pk, order_items)
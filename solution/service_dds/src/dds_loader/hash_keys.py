@@ -0,0 +1,73 @@
+import hashlib
+import numbers
+import uuid
+from decimal import Decimal
+from functools import lru_cache
+from typing import Hashable, Iterable, List
+
+
+class HashKeyGenerator:
+    """
+    единственное место, где вычисляются ключи хабов и линков dds и hashdiff сателлитов.
+    Ключ хаба - uuid3(NAMESPACE_X500, str(бизнес-ключ)),
+    ключ линка - uuid3(NAMESPACE_X500, ключи хабов через '/'),
+    hashdiff - md5 значений атрибутов через '|' (числа приводятся к одному виду: 1600.0 -> 1600).
+    Ключи продуктов, категорий, ресторанов, пользователей и их линков и hashdiff их атрибутов
+    повторяются из заказа в заказ - они мемоизируются в LRU-кэшах.
+    Ключи, которые у каждого заказа свои (сам заказ, его линки, стоимость), считаются
+    с memoize=False, чтобы не вытеснять из кэшей повторяющиеся.
+    """
+
+    def __init__(self, max_size: int = 100000) -> None:
+        self._hub_key_cached = lru_cache(maxsize=max_size)(self._hub_key)
+        self._link_key_cached = lru_cache(maxsize=max_size)(self._link_key)
+        self._hashdiff_cached = lru_cache(maxsize=max_size)(self._hashdiff)
+
+    def hub_key(self, business_key: Hashable, memoize: bool = True) -> uuid.UUID:
+        if memoize:
+            return self._hub_key_cached(business_key)
+        return self._hub_key(business_key)
+
+    def link_key(self, *hub_keys: uuid.UUID, memoize: bool = True) -> uuid.UUID:
+        if memoize:
+            return self._link_key_cached(*hub_keys)
+        return self._link_key(*hub_keys)
+
+    def hashdiff(self, *values: Hashable, memoize: bool = True) -> uuid.UUID:
+        values = tuple(self._normalize(value) for value in values)
+        if memoize:
+            return self._hashdiff_cached(*values)
+        return self._hashdiff(*values)
+
+    def hub_keys(self, business_keys: Iterable[Hashable]) -> List[uuid.UUID]:
+        """ключи хабов для списка повторяющихся бизнес-ключей (в том же порядке)"""
+        return [self._hub_key_cached(business_key) for business_key in business_keys]
+
+    def link_keys(self, hub_key_pairs: Iterable[tuple]) -> List[uuid.UUID]:
+        """ключи линков для списка кортежей ключей повторяющихся хабов (в том же порядке)"""
+        return [self._link_key_cached(*hub_keys) for hub_keys in hub_key_pairs]
+
+    @staticmethod
+    def _normalize(value: Hashable) -> Hashable:
+        # равные числа разных типов (1600, 1600.0, Decimal('1600.00')) дают один и тот же hashdiff
+        if isinstance(value, bool) or not isinstance(value, (numbers.Real, Decimal)):
+            return value
+        if float(value).is_integer():
+            return int(value)
+        return float(value)
+
+    @staticmethod
+    def _hub_key(business_key: Hashable) -> uuid.UUID:
+        return uuid.uuid3(uuid.NAMESPACE_X500, str(business_key))
+
+    @staticmethod
+    def _link_key(*hub_keys: uuid.UUID) -> uuid.UUID:
+        return uuid.uuid3(uuid.NAMESPACE_X500, '/'.join(str(hub_key) for hub_key in hub_keys))
+
+    @staticmethod
+    def _hashdiff(*values: Hashable) -> uuid.UUID:
+        return uuid.UUID(hashlib.md5('|'.join(str(value) for value in values).encode('utf-8')).hexdigest())
+
+
+# общий генератор сервиса
+hash_keys = HashKeyGenerator()
@@ -1,590 +1,442 @@
 import uuid
-from datetime import datetime
-from typing import Any, Dict, List
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, Tuple
 
+from dds_loader.dds_vault_batch import DdsVaultBatch
+from lib.metrics import processor_metrics
 from lib.pg import PgConnect
+from psycopg import Connection
 from pydantic import BaseModel
 
 
+# ключ advisory-блокировки, которой init_schema сериализуется между подами, стартующими одновременно
+_INIT_SCHEMA_LOCK_ID = 0x646473  # 'dds'
+
+# линки заказа не меняются: их только вставляем, и по вставленным считаем счётчики заказов
+_VAULT_BATCH_INSERT_ONLY_TABLES = ('l_order_product', 'l_order_user')
+
+
+def _unnest_upsert_statement(table: str, key_column: str, columns: List[Tuple[str, str]],
+                             insert_only: bool = False) -> str:
+    """
+    INSERT ... SELECT FROM unnest(...) ON CONFLICT DO UPDATE для таблицы dds:
+    каждая колонка передаётся одним параметром-массивом %(cN)s, load_dt и load_src - скалярами.
+    Если среди колонок есть hashdiff (сателлиты), существующая строка обновляется,
+    только когда hashdiff изменился.
+    insert_only - ON CONFLICT DO NOTHING RETURNING key_column: на выходе ключи реально вставленных строк.
+    """
+    column_names = [name for name, _ in columns]
+    update_condition = ''
+    if 'hashdiff' in column_names:
+        update_condition = f'WHERE dds.{table}.hashdiff IS DISTINCT FROM EXCLUDED.hashdiff'
+
+    if insert_only:
+        return """
+            INSERT INTO dds.{table}
+                ({insert_columns}, load_dt, load_src)
+            SELECT
+                {select_columns}, %(load_dt)s::timestamp, %(load_src)s::varchar
+            FROM unnest({unnest_params}) AS "u" ({unnest_columns})
+            ON CONFLICT ({key_column}) DO NOTHING
+            RETURNING {key_column}
+            ;
+        """.format(
+            table=table,
+            insert_columns=', '.join(column_names),
+            select_columns=', '.join(f'"u"."{name}"' for name in column_names),
+            unnest_params=', '.join(f'%(c{i})s::{pg_type}[]' for i, (_, pg_type) in enumerate(columns)),
+            unnest_columns=', '.join(f'"{name}"' for name in column_names),
+            key_column=key_column
+        )
+
+    return """
+        INSERT INTO dds.{table}
+            ({insert_columns}, load_dt, load_src)
+        SELECT
+            {select_columns}, %(load_dt)s::timestamp, %(load_src)s::varchar
+        FROM unnest({unnest_params}) AS "u" ({unnest_columns})
+        ON CONFLICT ({key_column}) DO UPDATE
+        SET
+            {update_columns}
+        {update_condition}
+        ;
+    """.format(
+        table=table,
+        insert_columns=', '.join(column_names),
+        select_columns=', '.join(f'"u"."{name}"' for name in column_names),
+        unnest_params=', '.join(f'%(c{i})s::{pg_type}[]' for i, (_, pg_type) in enumerate(columns)),
+        unnest_columns=', '.join(f'"{name}"' for name in column_names),
+        key_column=key_column,
+        update_columns=',\n            '.join(
+            f'{name} = EXCLUDED.{name}'
+            for name in column_names + ['load_dt', 'load_src'] if name != key_column
+        ),
+        update_condition=update_condition
+    )
+
+
 class DdsRepository:
     _db: PgConnect = None
+    _uow_conn: Optional[Connection] = None
+
+    # таблицы dds в порядке загрузки пачкой: хабы, сателлиты, линки.
+    # (имя таблицы = имя атрибута DdsVaultBatch, первичный ключ, колонки с типами для unnest)
+    _vault_batch_tables: List[Tuple[str, str, List[Tuple[str, str]]]] = [
+        ('h_order', 'h_order_pk', [
+            ('h_order_pk', 'uuid'), ('order_id', 'integer'), ('order_dt', 'timestamp')]),
+        ('s_order_cost', 'hk_order_cost_pk', [
+            ('hk_order_cost_pk', 'uuid'), ('h_order_pk', 'uuid'), ('cost', 'numeric'), ('payment', 'numeric'),
+            ('hashdiff', 'uuid')]),
+        ('s_order_status', 'hk_order_status_pk', [
+            ('hk_order_status_pk', 'uuid'), ('h_order_pk', 'uuid'), ('status', 'varchar'), ('hashdiff', 'uuid')]),
+        ('h_user', 'h_user_pk', [
+            ('h_user_pk', 'uuid'), ('user_id', 'varchar')]),
+        ('s_user_names', 'hk_user_names_pk', [
+            ('hk_user_names_pk', 'uuid'), ('h_user_pk', 'uuid'), ('username', 'varchar'), ('userlogin', 'varchar'),
+            ('hashdiff', 'uuid')]),
+        ('h_restaurant', 'h_restaurant_pk', [
+            ('h_restaurant_pk', 'uuid'), ('restaurant_id', 'varchar')]),
+        ('s_restaurant_names', 'hk_restaurant_names_pk', [
+            ('hk_restaurant_names_pk', 'uuid'), ('h_restaurant_pk', 'uuid'), ('name', 'varchar'), ('hashdiff', 'uuid')]),
+        ('h_category', 'h_category_pk', [
+            ('h_category_pk', 'uuid'), ('category_name', 'varchar')]),
+        ('h_product', 'h_product_pk', [
+            ('h_product_pk', 'uuid'), ('product_id', 'varchar')]),
+        ('s_product_names', 'hk_product_names_pk', [
+            ('hk_product_names_pk', 'uuid'), ('h_product_pk', 'uuid'), ('name', 'varchar'), ('hashdiff', 'uuid')]),
+        ('l_product_category', 'hk_product_category_pk', [
+            ('hk_product_category_pk', 'uuid'), ('h_product_pk', 'uuid'), ('h_category_pk', 'uuid')]),
+        ('l_product_restaurant', 'hk_product_restaurant_pk', [
+            ('hk_product_restaurant_pk', 'uuid'), ('h_product_pk', 'uuid'), ('h_restaurant_pk', 'uuid')]),
+        ('l_order_product', 'hk_order_product_pk', [
+            ('hk_order_product_pk', 'uuid'), ('h_order_pk', 'uuid'), ('h_product_pk', 'uuid')]),
+        ('l_order_user', 'hk_order_user_pk', [
+            ('hk_order_user_pk', 'uuid'), ('h_order_pk', 'uuid'), ('h_user_pk', 'uuid')]),
+    ]
+    _vault_batch_statements: Dict[str, str] = {
+        table: _unnest_upsert_statement(table, key_column, columns, table in _VAULT_BATCH_INSERT_ONLY_TABLES)
+        for table, key_column, columns in _vault_batch_tables
+    }
+
+    # сателлиты с колонкой hashdiff
+    _satellite_tables: List[str] = [
+        's_order_cost', 's_order_status', 's_user_names', 's_restaurant_names', 's_product_names'
+    ]
 
     def __init__(self, db: PgConnect) -> None:
         self._db = db
+        self._uow_conn = None
 
-    def get_user_category_counters(self, user_pk: str, dict_category_pk: dict) -> list:
+    def init_schema(self) -> None:
         """
-        агрегирует заказы посетителя по категориям товаров
-        для заданного id пользователя и списка id категорий (все id - строки).
-        на выходе - list od dicts; ключи в каждом словаре:
-        "h_user_pk", "h_category_pk", "category_name", "order_cnt".
-        Если ничего не найдено - на выходе пустой список.
+        добавляет колонку hashdiff в сателлиты, где её ещё нет.
+        Старые строки остаются с hashdiff = NULL и перезапишутся при первом же upsert-е.
+        Создаёт таблицы счётчиков dds.user_product_counters и dds.user_category_counters,
+        если их ещё нет, и один раз заполняет их по всей истории заказов.
+        Каждый шаг - в своей транзакции: ALTER TABLE держит AccessExclusiveLock на сателлите
+        до commit-а, так что долгое заполнение счётчиков не должно идти в той же транзакции.
+        Таблица счётчиков создаётся и заполняется в одной транзакции - если заполнение упадёт,
+        при следующем старте оно начнётся заново.
+        Каждая транзакция начинается с pg_advisory_xact_lock: поды, стартующие одновременно,
+        проходят шаги по очереди, и второй видит уже созданные первым таблицы.
+        Заполнение - снимок истории: дальше счётчики ведёт только этот код, поэтому на время
+        заполнения старых подов dds (без счётчиков) быть не должно - deployment dds обновляется
+        через strategy: Recreate (см. helm-чарт service_dds/app).
+        """
+
+        # ALTER TABLE берёт блокировку, даже когда колонка уже есть, поэтому сначала проверяем
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%(lock_id)s::bigint);", {'lock_id': _INIT_SCHEMA_LOCK_ID})
+                cur.execute(
+                    """
+                        SELECT table_name
+                        FROM information_schema.columns
+                        WHERE table_schema = 'dds'
+                            AND table_name = ANY(%(tables)s)
+                            AND column_name = 'hashdiff'
+                        ;
+                    """,
+                    {'tables': self._satellite_tables}
+                )
+                with_hashdiff = {record[0] for record in cur}
+                for table in self._satellite_tables:
+                    if table not in with_hashdiff:
+                        cur.execute(
+                            "ALTER TABLE dds.{table} ADD COLUMN IF NOT EXISTS hashdiff uuid;".format(table=table)
+                        )
+
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%(lock_id)s::bigint);", {'lock_id': _INIT_SCHEMA_LOCK_ID})
+                cur.execute("SELECT to_regclass('dds.user_product_counters');")
+                if cur.fetchone()[0] is None:
+                    cur.execute("""
+                        CREATE TABLE dds.user_product_counters (
+                            h_user_pk uuid NOT NULL,
+                            h_product_pk uuid NOT NULL,
+                            order_cnt int NOT NULL DEFAULT 0,
+                            PRIMARY KEY (h_user_pk, h_product_pk)
+                        );
+                    """)
+                    cur.execute("""
+                        INSERT INTO dds.user_product_counters
+                            (h_user_pk, h_product_pk, order_cnt)
+                        SELECT
+                            "ou"."h_user_pk",
+                            "op"."h_product_pk",
+                            COUNT(DISTINCT "ou"."h_order_pk")
+                        FROM
+                            "dds"."l_order_user" as "ou"
+                            INNER JOIN "dds"."l_order_product" "op" ON (
+                                "op"."h_order_pk" = "ou"."h_order_pk"
+                            )
+                        GROUP BY ("ou"."h_user_pk", "op"."h_product_pk")
+                        ;
+                    """)
+
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%(lock_id)s::bigint);", {'lock_id': _INIT_SCHEMA_LOCK_ID})
+                cur.execute("SELECT to_regclass('dds.user_category_counters');")
+                if cur.fetchone()[0] is None:
+                    cur.execute("""
+                        CREATE TABLE dds.user_category_counters (
+                            h_user_pk uuid NOT NULL,
+                            h_category_pk uuid NOT NULL,
+                            order_cnt int NOT NULL DEFAULT 0,
+                            PRIMARY KEY (h_user_pk, h_category_pk)
+                        );
+                    """)
+                    cur.execute("""
+                        INSERT INTO dds.user_category_counters
+                            (h_user_pk, h_category_pk, order_cnt)
+                        SELECT
+                            "ou"."h_user_pk",
+                            "pc"."h_category_pk",
+                            COUNT(DISTINCT "ou"."h_order_pk")
+                        FROM
+                            "dds"."l_order_user" as "ou"
+                            INNER JOIN "dds"."l_order_product" "op" ON (
+                                "op"."h_order_pk" = "ou"."h_order_pk"
+                            )
+                            INNER JOIN "dds"."l_product_category" "pc" ON (
+                                "pc"."h_product_pk" = "op"."h_product_pk"
+                            )
+                        GROUP BY ("ou"."h_user_pk", "pc"."h_category_pk")
+                        ;
+                    """)
+
+    @contextmanager
+    def unit_of_work(self) -> Generator[None, None, None]:
+        """
+        все запросы репозитория внутри блока идут через одно подключение
+        в одной транзакции: commit на выходе из блока, rollback при исключении.
+        Вложенный unit_of_work() просто продолжает внешнюю транзакцию.
+        """
+        if self._uow_conn is not None:
+            yield
+            return
+
+        with self._db.connection() as conn:
+            self._uow_conn = conn
+            try:
+                yield
+            finally:
+                self._uow_conn = None
+
+    @contextmanager
+    def _connection(self) -> Generator[Connection, None, None]:
+        if self._uow_conn is not None:
+            yield self._uow_conn
+            return
+
+        with self._db.connection() as conn:
+            yield conn
+
+    def vault_batch_upsert(self, batch: DdsVaultBatch) -> Dict[str, Set[uuid.UUID]]:
+        """
+        upsert пачки заказов во все таблицы dds: по одному INSERT ... SELECT FROM unnest(...)
+        на таблицу, строки внутри пачки уже дедуплицированы по первичному ключу.
+        Всё в одной транзакции (внутри unit_of_work() - в его транзакции).
+        На выходе - ключи реально вставленных строк линков заказа
+        (_VAULT_BATCH_INSERT_ONLY_TABLES), по таблицам.
         """
 
-        counters = []
+        inserted_keys = {table: set() for table in _VAULT_BATCH_INSERT_ONLY_TABLES}
+        with self.unit_of_work():
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    for table, _, _ in self._vault_batch_tables:
+                        rows = getattr(batch, table)
+                        if not rows:
+                            continue
+                        params = {
+                            'load_dt': batch.load_dt,
+                            'load_src': batch.load_src
+                        }
+                        # строки - по возрастанию ключа: параллельные воркеры блокируют общие строки
+                        # в одном и том же порядке и не ловят deadlock.
+                        # значения передаём текстом, в нужные типы их приводят касты в unnest
+                        sorted_rows = [row for _, row in sorted(rows.items())]
+                        for i, column in enumerate(zip(*sorted_rows)):
+                            params[f'c{i}'] = [str(value) for value in column]
+                        with processor_metrics.stage(f'pg_upsert_{table}'):
+                            cur.execute(self._vault_batch_statements[table], params)
+                            if table in inserted_keys:
+                                inserted_keys[table].update(record[0] for record in cur)
+
+        return inserted_keys
+
+    def counters_increment(self, product_deltas: Dict[tuple, int], category_deltas: Dict[tuple, int]) -> None:
+        """
+        прибавляет приращения к счётчикам заказов dds.user_product_counters
+        ((h_user_pk, h_product_pk) -> delta) и dds.user_category_counters
+        ((h_user_pk, h_category_pk) -> delta), по одному запросу на таблицу.
+        """
+
+        increment_statement = """
+            INSERT INTO dds.{table}
+                (h_user_pk, {key_column}, order_cnt)
+            SELECT "u"."h_user_pk", "u"."{key_column}", "u"."delta"
+            FROM unnest(%(user_pks)s::uuid[], %(keys)s::uuid[], %(deltas)s::int[]) AS "u" ("h_user_pk", "{key_column}", "delta")
+            ON CONFLICT (h_user_pk, {key_column}) DO UPDATE
+            SET
+                order_cnt = dds.{table}.order_cnt + EXCLUDED.order_cnt
+            ;
+        """
 
-        # dict там на входе - как вариант дедупликации;
-        # берём keys(), маппим uuid-ы в строки, джойним
-        category_pk_stringified = list(map(lambda x: str(x), dict_category_pk.keys()))
-        str_category_pk = "'" + ("', '".join(category_pk_stringified)) + "'"
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                for table, key_column, deltas in (
+                    ('user_product_counters', 'h_product_pk', product_deltas),
+                    ('user_category_counters', 'h_category_pk', category_deltas)
+                ):
+                    if not deltas:
+                        continue
+                    # по возрастанию ключа - чтобы параллельные воркеры не ловили deadlock
+                    sorted_deltas = sorted(deltas.items())
+                    params = {
+                        'user_pks': [user_pk for (user_pk, _), _ in sorted_deltas],
+                        'keys': [key for (_, key), _ in sorted_deltas],
+                        'deltas': [delta for _, delta in sorted_deltas]
+                    }
+                    cur.execute(increment_statement.format(table=table, key_column=key_column), params)
+
+    def get_recent_keys(self, table: str, limit: int) -> list:
+        """
+        первичные ключи последних загруженных (по load_dt) строк таблицы dds
+        (одной из _vault_batch_tables) - для прогрева кэша уже записанных ключей.
+        """
+
+        key_column = next(key for name, key, _ in self._vault_batch_tables if name == table)
+        query = """
+            SELECT {key_column}
+            FROM dds.{table}
+            ORDER BY load_dt DESC
+            LIMIT %(limit)s
+            ;
+        """.format(table=table, key_column=key_column)
+        params = {
+            'limit': limit
+        }
+
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                return [record[0] for record in cur]
+
+    def get_users_category_counters(self, pairs: Iterable[Tuple[uuid.UUID, uuid.UUID]]) -> Dict[str, list]:
+        """
+        счётчики заказов по категориям для всех пар (h_user_pk, h_category_pk) пачки - одним запросом.
+        на выходе - dict: h_user_pk (строкой) -> list of dicts, ключи в каждом словаре:
+        "h_user_pk", "h_category_pk", "category_name", "order_cnt".
+        """
+
+        counters = defaultdict(list)
+        pairs = set(pairs)
+        if not pairs:
+            return counters
 
         query = """
             SELECT
-                "u"."h_user_pk",
-                "c"."h_category_pk",
+                "uc"."h_user_pk",
+                "uc"."h_category_pk",
                 "c"."category_name",
-                COUNT(DISTINCT "ou"."h_order_pk") as "order_cnt"
+                "uc"."order_cnt"
             FROM
-                "dds"."h_user" as "u"
-                INNER JOIN "dds"."l_order_user" as "ou" ON (
-                    "ou"."h_user_pk" = "u"."h_user_pk"
-                )
-                INNER JOIN "dds"."l_order_product" "op" ON (
-                    "op"."h_order_pk" = "ou"."h_order_pk"
-                )
-                INNER JOIN "dds"."l_product_category" "pc" ON (
-                    "pc"."h_product_pk" = "op"."h_product_pk"
+                unnest(%(user_pks)s::uuid[], %(category_pks)s::uuid[]) AS "p" ("h_user_pk", "h_category_pk")
+                INNER JOIN "dds"."user_category_counters" as "uc" ON (
+                    "uc"."h_user_pk" = "p"."h_user_pk"
+                    AND "uc"."h_category_pk" = "p"."h_category_pk"
                 )
                 INNER JOIN "dds"."h_category" "c" ON (
-                    "c"."h_category_pk" = "pc"."h_category_pk"
+                    "c"."h_category_pk" = "uc"."h_category_pk"
                 )
-            WHERE
-                "u"."h_user_pk" = '{filter_user_pk}'
-                AND "c"."h_category_pk" IN ({filter_category_pk})
-            GROUP BY ("u"."h_user_pk", "c"."h_category_pk", "c"."category_name")
             ;
-        """.format(
-            filter_user_pk=user_pk,
-            filter_category_pk=str_category_pk
-        )
+        """
+        params = {
+            'user_pks': [user_pk for user_pk, _ in pairs],
+            'category_pks': [category_pk for _, category_pk in pairs]
+        }
 
-        with self._db.connection() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(query)
+                cur.execute(query, params)
                 for record in cur:
-                    counters.append({
+                    counters[str(record[0])].append({
                         "h_user_pk": str(record[0]),  # 'h_user_pk'
                         "h_category_pk": str(record[1]),  # 'h_category_pk'
                         "category_name": record[2],  # 'category_name'
                         "order_cnt": record[3]  # 'order_cnt'
                     })
-                cur.close()
 
         return counters
 
-    def get_user_product_counters(self, user_pk: str, dict_product_pk: dict) -> list:
+    def get_users_product_counters(self, pairs: Iterable[Tuple[uuid.UUID, uuid.UUID]]) -> Dict[str, list]:
         """
-        агрегирует заказы посетителя по продуктам (блюдам)
-        для заданного id пользователя и списка id продуктов (все id - строки).
-        на выходе - list od dicts; ключи в каждом словаре:
+        счётчики заказов по продуктам для всех пар (h_user_pk, h_product_pk) пачки - одним запросом.
+        на выходе - dict: h_user_pk (строкой) -> list of dicts, ключи в каждом словаре:
         "h_user_pk", "h_product_pk", "product_name", "order_cnt".
-        Если ничего не найдено - на выходе пустой список.
         """
 
-        counters = []
-
-        # dict там на входе - как вариант дедупликации;
-        # берём keys(), маппим uuid-ы в строки, джойним
-        product_pk_stringified = list(map(lambda x: str(x), dict_product_pk.keys()))
-        str_product_pk = "'" + ("', '".join(product_pk_stringified)) + "'"
+        counters = defaultdict(list)
+        pairs = set(pairs)
+        if not pairs:
+            return counters
 
         query = """
             SELECT
-                "u"."h_user_pk",
-                "op"."h_product_pk",
+                "uc"."h_user_pk",
+                "uc"."h_product_pk",
                 "pn"."name" as "product_name",
-                COUNT(DISTINCT "ou"."h_order_pk") as "order_cnt"
+                "uc"."order_cnt"
             FROM
-                "dds"."h_user" as "u"
-                INNER JOIN "dds"."l_order_user" as "ou" ON (
-                    "ou"."h_user_pk" = "u"."h_user_pk"
-                )
-                INNER JOIN "dds"."l_order_product" "op" ON (
-                    "op"."h_order_pk" = "ou"."h_order_pk"
+                unnest(%(user_pks)s::uuid[], %(product_pks)s::uuid[]) AS "p" ("h_user_pk", "h_product_pk")
+                INNER JOIN "dds"."user_product_counters" as "uc" ON (
+                    "uc"."h_user_pk" = "p"."h_user_pk"
+                    AND "uc"."h_product_pk" = "p"."h_product_pk"
                 )
                 INNER JOIN "dds"."s_product_names" "pn" ON (
-                    "pn"."h_product_pk" = "op"."h_product_pk"
+                    "pn"."h_product_pk" = "uc"."h_product_pk"
                 )
-            WHERE
-                "u"."h_user_pk" = '{filter_user_pk}'
-                AND "op"."h_product_pk" IN ({filter_product_pk})
-            GROUP BY ("u"."h_user_pk", "op"."h_product_pk", "pn"."name")
             ;
-        """.format(
-            filter_user_pk=user_pk,
-            filter_product_pk=str_product_pk
-        )
+        """
+        params = {
+            'user_pks': [user_pk for user_pk, _ in pairs],
+            'product_pks': [product_pk for _, product_pk in pairs]
+        }
 
-        with self._db.connection() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(query)
+                cur.execute(query, params)
                 for record in cur:
-                    counters.append({
+                    counters[str(record[0])].append({
                         "h_user_pk": str(record[0]),  # 'h_user_pk'
                         "h_product_pk": str(record[1]),  # 'h_product_pk'
                         "product_name": record[2],  # 'product_name'
                         "order_cnt": record[3]  # 'order_cnt'
                     })
-                cur.close()
 
         return counters
-
-    def l_order_user_upsert(self, hk_order_user_pk: str,
-                            h_order_pk: str, h_user_pk: str,
-                            load_dt: datetime, load_src: str) -> None:
-        """upsert l_order_user"""
-
-        # dds.l_order_user
-        upsert_statement = """
-            INSERT INTO dds.l_order_user
-                (hk_order_user_pk, h_order_pk, h_user_pk, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_order_user_pk}',
-                    '{upsert_h_order_pk}',
-                    '{upsert_h_user_pk}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_order_user_pk) DO UPDATE
-            SET
-                h_order_pk = EXCLUDED.h_order_pk,
-                h_user_pk = EXCLUDED.h_user_pk,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_order_user_pk=hk_order_user_pk,
-            upsert_h_order_pk=h_order_pk,
-            upsert_h_user_pk=h_user_pk,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def l_order_product_upsert(self, hk_order_product_pk: str,
-                                    h_order_pk: str, h_product_pk: str,
-                                    load_dt: datetime, load_src: str) -> None:
-        """upsert l_order_product"""
-
-        # dds.l_order_product
-        upsert_statement = """
-            INSERT INTO dds.l_order_product
-                (hk_order_product_pk, h_order_pk, h_product_pk, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_order_product_pk}',
-                    '{upsert_h_order_pk}',
-                    '{upsert_h_product_pk}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_order_product_pk) DO UPDATE
-            SET
-                h_order_pk = EXCLUDED.h_order_pk,
-                h_product_pk = EXCLUDED.h_product_pk,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_order_product_pk=hk_order_product_pk,
-            upsert_h_order_pk=h_order_pk,
-            upsert_h_product_pk=h_product_pk,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def l_product_restaurant_upsert(self, hk_product_restaurant_pk: str,
-                                    h_product_pk: str, h_restaurant_pk: str,
-                                    load_dt: datetime, load_src: str) -> None:
-        """upsert l_product_restaurant"""
-
-        # dds.l_product_restaurant
-        upsert_statement = """
-            INSERT INTO dds.l_product_restaurant
-                (hk_product_restaurant_pk, h_product_pk, h_restaurant_pk, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_product_restaurant_pk}',
-                    '{upsert_h_product_pk}',
-                    '{upsert_h_restaurant_pk}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_product_restaurant_pk) DO UPDATE
-            SET
-                h_product_pk = EXCLUDED.h_product_pk,
-                h_restaurant_pk = EXCLUDED.h_restaurant_pk,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_product_restaurant_pk=hk_product_restaurant_pk,
-            upsert_h_product_pk=h_product_pk,
-            upsert_h_restaurant_pk=h_restaurant_pk,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def l_product_category_upsert(self, hk_product_category_pk: str,
-                                  h_product_pk: str, h_category_pk: str,
-                                  load_dt: datetime, load_src: str) -> None:
-        """upsert l_product_category"""
-
-        # dds.l_product_category
-        upsert_statement = """
-            INSERT INTO dds.l_product_category
-                (hk_product_category_pk, h_product_pk, h_category_pk, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_product_category_pk}',
-                    '{upsert_h_product_pk}',
-                    '{upsert_h_category_pk}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_product_category_pk) DO UPDATE
-            SET
-                h_product_pk = EXCLUDED.h_product_pk,
-                h_category_pk = EXCLUDED.h_category_pk,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_product_category_pk=hk_product_category_pk,
-            upsert_h_product_pk=h_product_pk,
-            upsert_h_category_pk=h_category_pk,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def product_upsert(self, h_product_pk: str, product_id: str,
-                       product_name: str,
-                       load_dt: datetime, load_src: str) -> None:
-        """upsert h_product, s_product_names"""
-
-        # dds.h_product
-        upsert_statement = """
-            INSERT INTO dds.h_product
-                (h_product_pk, product_id, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_h_product_pk}',
-                    '{upsert_product_id}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (h_product_pk) DO UPDATE
-            SET
-                product_id = EXCLUDED.product_id,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_h_product_pk=h_product_pk,
-            upsert_product_id=product_id,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-        # dds.s_product_names
-        upsert_statement = """
-            INSERT INTO dds.s_product_names
-                (hk_product_names_pk, h_product_pk, name, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_product_names_pk}',
-                    '{upsert_h_product_pk}',
-                    '{upsert_name}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_product_names_pk) DO UPDATE
-            SET
-                h_product_pk = EXCLUDED.h_product_pk,
-                name = EXCLUDED.name,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_product_names_pk=h_product_pk,
-            upsert_h_product_pk=h_product_pk,
-            upsert_name=product_name,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def category_upsert(self, h_category_pk: str, category_name: str,
-                        load_dt: datetime, load_src: str) -> None:
-        """upsert h_category"""
-
-        # dds.h_category
-        upsert_statement = """
-            INSERT INTO dds.h_category
-                (h_category_pk, category_name, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_h_category_pk}',
-                    '{upsert_category_name}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (h_category_pk) DO UPDATE
-            SET
-                category_name = EXCLUDED.category_name,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_h_category_pk=h_category_pk,
-            upsert_category_name=category_name,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def restaurant_upsert(self, h_restaurant_pk: str, restaurant_id: str,
-                          restaurant_name: str,
-                          load_dt: datetime, load_src: str) -> None:
-        """upsert h_restaurant, s_restaurant_names"""
-
-        # dds.h_restaurant
-        upsert_statement = """
-            INSERT INTO dds.h_restaurant
-                (h_restaurant_pk, restaurant_id, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_h_restaurant_pk}',
-                    '{upsert_restaurant_id}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (h_restaurant_pk) DO UPDATE
-            SET
-                restaurant_id = EXCLUDED.restaurant_id,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_h_restaurant_pk=h_restaurant_pk,
-            upsert_restaurant_id=restaurant_id,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-        # dds.s_restaurant_names
-        upsert_statement = """
-            INSERT INTO dds.s_restaurant_names
-                (hk_restaurant_names_pk, h_restaurant_pk, name, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_restaurant_names_pk}',
-                    '{upsert_h_restaurant_pk}',
-                    '{upsert_name}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_restaurant_names_pk) DO UPDATE
-            SET
-                h_restaurant_pk = EXCLUDED.h_restaurant_pk,
-                name = EXCLUDED.name,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_restaurant_names_pk=h_restaurant_pk,
-            upsert_h_restaurant_pk=h_restaurant_pk,
-            upsert_name=restaurant_name,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def user_upsert(self, h_user_pk: str, user_id: str,
-                    username: str, userlogin: str,
-                    load_dt: datetime, load_src: str) -> None:
-        """upsert h_user, s_user_names"""
-
-        # dds.h_user
-        upsert_statement = """
-            INSERT INTO dds.h_user
-                (h_user_pk, user_id, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_h_user_pk}',
-                    '{upsert_user_id}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (h_user_pk) DO UPDATE
-            SET
-                user_id = EXCLUDED.user_id,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_h_user_pk=h_user_pk,
-            upsert_user_id=user_id,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-        # dds.s_user_names
-        upsert_statement = """
-            INSERT INTO dds.s_user_names
-                (hk_user_names_pk, h_user_pk, username, userlogin, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_user_names_pk}',
-                    '{upsert_h_user_pk}',
-                    '{upsert_username}',
-                    '{upsert_userlogin}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_user_names_pk) DO UPDATE
-            SET
-                h_user_pk = EXCLUDED.h_user_pk,
-                username = EXCLUDED.username,
-                userlogin = EXCLUDED.userlogin,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_user_names_pk=h_user_pk,
-            upsert_h_user_pk=h_user_pk,
-            upsert_username=username,
-            upsert_userlogin=userlogin,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-    def order_upsert(self, h_order_pk: str, order_id: int, order_dt: datetime,
-                     order_cost: float, order_payment: float, order_status: str,
-                     load_dt: datetime, load_src: str
-                     ) -> None:
-        """upsert dds.h_order, s_order_cost, s_order_status"""
-
-        # dds.h_order
-        upsert_statement = """
-            INSERT INTO dds.h_order
-                (h_order_pk, order_id, order_dt, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_h_order_pk}',
-                    {upsert_order_id},
-                    '{upsert_order_dt}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (h_order_pk) DO UPDATE
-            SET
-                order_id = EXCLUDED.order_id,
-                order_dt = EXCLUDED.order_dt,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_h_order_pk=h_order_pk,
-            upsert_order_id=order_id,
-            upsert_order_dt=order_dt,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-        # dds.s_order_cost
-        upsert_statement = """
-            INSERT INTO dds.s_order_cost
-                (hk_order_cost_pk, h_order_pk, cost, payment, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_order_cost_pk}',
-                    '{upsert_h_order_pk}',
-                    {upsert_cost},
-                    {upsert_payment},
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_order_cost_pk) DO UPDATE
-            SET
-                h_order_pk = EXCLUDED.h_order_pk,
-                cost = EXCLUDED.cost,
-                payment = EXCLUDED.payment,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_order_cost_pk=h_order_pk,
-            upsert_h_order_pk=h_order_pk,
-            upsert_cost=order_cost,
-            upsert_payment=order_payment,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
-        # dds.s_order_status
-        upsert_statement = """
-            INSERT INTO dds.s_order_status
-                (hk_order_status_pk, h_order_pk, status, load_dt, load_src)
-            VALUES
-                (
-                    '{upsert_hk_order_status_pk}',
-                    '{upsert_h_order_pk}',
-                    '{upsert_status}',
-                    '{upsert_load_dt}',
-                    '{upsert_load_src}'
-                )
-            ON CONFLICT (hk_order_status_pk) DO UPDATE
-            SET
-                h_order_pk = EXCLUDED.h_order_pk,
-                status = EXCLUDED.status,
-                load_dt = EXCLUDED.load_dt,
-                load_src = EXCLUDED.load_src
-            ;
-        """.format(
-            upsert_hk_order_status_pk=h_order_pk,
-            upsert_h_order_pk=h_order_pk,
-            upsert_status=order_status,
-            upsert_load_dt=load_dt,
-            upsert_load_src=load_src
-        )
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(upsert_statement)
-
@@ -0,0 +1,30 @@
+from collections import OrderedDict
+from typing import Hashable, Iterable
+
+
+class SeenKeyCache:
+    """
+    ограниченное по размеру множество ключей, которые уже точно записаны в dds
+    (ключи - пары (таблица, pk)). Когда множество переполняется,
+    вытесняются ключи, к которым дольше всего не обращались (LRU).
+    """
+
+    def __init__(self, max_size: int = 50000) -> None:
+        self._max_size = max_size
+        self._keys: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def update(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+        while len(self._keys) > self._max_size:
+            self._keys.popitem(last=False)
@@ -0,0 +1,2 @@
+from . import processor_metrics  # noqa
+from . import stage_profiler  # noqa
@@ -0,0 +1,69 @@
+import time
+from logging import Logger
+from typing import Any, Callable, Dict, List
+
+from .processor_runner import ProcessorRunner
+
+
+class ProcessorPool:
+    """
+    несколько воркеров одного сервиса - каждый в своём потоке со своим ProcessorRunner.
+    make_processor(номер воркера) строит воркеру отдельный процессор (объект с run() и close())
+    со своим KafkaConsumer в общей consumer group, своим пулом PG и своими клиентами Kafka/Redis;
+    партиции топика Kafka сама распределяет между консьюмерами группы.
+    Время уходит в основном на ожидание Kafka и PG (GIL при этом отпускается),
+    поэтому потоков достаточно.
+    """
+
+    def __init__(self,
+                 make_processor: Callable[[int], Any],
+                 workers: int,
+                 logger: Logger,
+                 idle_backoff_min: float = 0.1,
+                 idle_backoff_max: float = 5.0,
+                 name: str = 'processor',
+                 max_failures: int = 10,
+                 max_silence: float = 120.0
+                 ) -> None:
+        self._runners: List[ProcessorRunner] = []
+        self._processors: Dict[str, Any] = {}
+        for worker in range(max(workers, 1)):
+            proc = make_processor(worker)
+            self._processors[f'{name}-{worker}'] = proc
+            self._runners.append(ProcessorRunner(
+                proc.run,
+                logger,
+                idle_backoff_min,
+                idle_backoff_max,
+                on_stop=proc.close,
+                name=f'{name}-{worker}',
+                max_failures=max_failures,
+                max_silence=max_silence
+            ))
+
+    def __len__(self) -> int:
+        return len(self._runners)
+
+    def start(self) -> None:
+        for runner in self._runners:
+            runner.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        # сначала всем воркерам - сигнал остановки, потом ждём их, в сумме не дольше timeout
+        for runner in self._runners:
+            runner.request_stop()
+        deadline = time.monotonic() + timeout
+        for runner in self._runners:
+            runner.stop(max(deadline - time.monotonic(), 0))
+
+    def is_alive(self) -> bool:
+        """все воркеры работают (ProcessorRunner.is_healthy)"""
+        return all(runner.is_healthy() for runner in self._runners)
+
+    def status(self) -> Dict[str, bool]:
+        """имя воркера -> работает ли он (ProcessorRunner.is_healthy)"""
+        return {runner.name: runner.is_healthy() for runner in self._runners}
+
+    def processors(self) -> Dict[str, Any]:
+        """имя воркера -> его процессор"""
+        return dict(self._processors)
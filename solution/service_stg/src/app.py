@@ -1,46 +1,109 @@
 import logging
+import signal
+import sys
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, jsonify, request
 
 from app_config import AppConfig
+from lib.metrics import processor_metrics
+from lib.metrics.stage_profiler import profiler
+from lib.runner import ProcessorPool
 from stg_loader.repository.stg_repository import StgRepository
 from stg_loader.stg_message_processor_job import StgMessageProcessor
 
 app = Flask(__name__)
 
+# воркеры (потоки), в которых крутятся обработчики сообщений; заводятся при старте сервиса.
+workers: ProcessorPool = None
+
 
 # Заводим endpoint для проверки, поднялся ли сервис.
 # Обратиться к нему можно будет GET-запросом по адресу localhost:5000/health.
-# Если в ответе будет healthy - сервис поднялся и работает.
+# Если в ответе будет healthy - сервис поднялся и работает,
+# если unhealthy (503) - хотя бы один из воркеров остановился, раз за разом падает или давно не обработал пачку.
 @app.get('/health')
 def health():
+    if workers is not None and not workers.is_alive():
+        return 'unhealthy', 503
     return 'healthy'
 
 
+# Метрики в формате Prometheus: сообщения и размеры пачек,
+# гистограммы времени этапов (Kafka, Redis, PG) и ошибки по этапам.
+@app.get('/metrics')
+def metrics():
+    body, content_type = processor_metrics.exposition()
+    return body, 200, {'Content-Type': content_type}
+
+
+# отставание консьюмеров от конца исходного топика: воркер -> {партиция: сообщений}
+@app.get('/lag')
+def lag():
+    if workers is None:
+        return jsonify({})
+    return jsonify({
+        name: {str(partition): value for partition, value in proc.lag().items()}
+        for name, proc in workers.processors().items()
+    })
+
+
+# Разбивка времени обработки по этапам (по выборке запусков обработчика, PROFILE_SAMPLE_RATE):
+# ?reset=1 - сбросить накопленное, ?cprofile=N - снять cProfile воркеров за N секунд (не больше 60).
+@app.get('/debug/profile')
+def debug_profile():
+    cprofile_seconds = request.args.get('cprofile', type=float)
+    if cprofile_seconds is not None:
+        stats = profiler.capture_cprofile(min(max(cprofile_seconds, 0.0), 60.0))
+        if stats is None:
+            return 'cprofile capture already running', 409
+        return stats, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    snapshot = profiler.snapshot()
+    if request.args.get('reset'):
+        profiler.reset()
+    return jsonify(snapshot)
+
+
 if __name__ == '__main__':
     # Устанавливаем уровень логгирования в Debug, чтобы иметь возможность просматривать отладочные логи.
     app.logger.setLevel(logging.DEBUG)
 
     # Инициализируем конфиг. Для удобства, вынесли логику получения значений переменных окружения в отдельный класс.
     config = AppConfig()
+    profiler.sample_rate = config.profile_sample_rate
+
+    # Процессор сообщений для воркера: у каждого воркера свои consumer (в общей группе),
+    # producer, клиент Redis и пул подключений к PG.
+    # Размер пачки подбирается по отставанию консьюмера (LagMonitor).
+    def make_processor(worker: int) -> StgMessageProcessor:
+        consumer = config.kafka_consumer()
+        return StgMessageProcessor(
+            consumer,
+            config.kafka_producer(),
+            config.redis_cache(),
+            StgRepository(config.pg_warehouse_db()),
+            config.lag_monitor(consumer),
+            app.logger
+        )
 
-    # Инициализируем процессор сообщений.
-    # Пока он пустой. Нужен для того, чтобы потом в нем писать логику обработки сообщений из Kafka.
-    proc = StgMessageProcessor(
-        config.kafka_consumer(),
-        config.kafka_producer(),
-        config.redis_client(),
-        StgRepository(config.pg_warehouse_db()),
-        100,
-        app.logger
+    # Запускаем процессоры в бэкграунде, каждый в своём потоке.
+    # ProcessorRunner воркера вызывает функцию run своего обработчика(StgMessageProcessor) без перерывов,
+    # пока в Kafka есть сообщения, а на пустом топике ждёт с нарастающей паузой.
+    workers = ProcessorPool(
+        make_processor,
+        config.processor_workers,
+        app.logger,
+        config.idle_backoff_min,
+        config.idle_backoff_max,
+        name='stg-processor'
     )
+    workers.start()
 
-    # Запускаем процессор в бэкграунде.
-    # BackgroundScheduler будет по расписанию вызывать функцию run нашего обработчика(StgMessageProcessor).
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
-    scheduler.start()
+    # SIGTERM (остановка пода) превращаем в обычный выход, чтобы корректно остановить обработчик.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     # стартуем Flask-приложение.
-    app.run(debug=True, host='0.0.0.0', use_reloader=False)
+    try:
+        app.run(debug=True, host='0.0.0.0', use_reloader=False)
+    finally:
+        workers.stop()
@@ -0,0 +1 @@
+from . import json_codec  # noqa
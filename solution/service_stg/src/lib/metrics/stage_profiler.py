@@ -0,0 +1,139 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Generator, List, Optional
+
+
+class StageProfiler:
+    """
+    выборочный профайлер этапов обработки: из каждого run() процессора с вероятностью sample_rate
+    выбирается один, и для него копится время всех этапов (processor_metrics.stage) -
+    суммарно, в среднем, максимум и в пересчёте на одно сообщение.
+    По запросу (capture_cprofile) каждый поток-воркер на N секунд включает у себя cProfile.
+    """
+
+    def __init__(self, sample_rate: float = 0.01) -> None:
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages: Dict[str, List[float]] = {}  # этап -> [count, total, max]
+        self._runs = 0
+        self._messages = 0
+        # cProfile по запросу
+        self._capture_lock = threading.Lock()
+        self._capture_until: Optional[float] = None
+        self._capture_profiles: List[cProfile.Profile] = []
+
+    @contextmanager
+    def run(self) -> Generator[None, None, None]:
+        """оборачивает один run() процессора: решает, попадает ли он в выборку, и ведёт cProfile потока"""
+        self._local.sampled = random.random() < self.sample_rate
+        if self._local.sampled:
+            with self._lock:
+                self._runs += 1
+        profile = self._thread_profile()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._local.sampled = False
+
+    def record(self, stage: str, seconds: float) -> None:
+        if not getattr(self._local, 'sampled', False):
+            return
+        with self._lock:
+            stat = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+    def messages(self, count: int) -> None:
+        if not getattr(self._local, 'sampled', False):
+            return
+        with self._lock:
+            self._messages += count
+
+    def snapshot(self) -> dict:
+        """разбивка по этапам (время - в миллисекундах), самые дорогие этапы - первыми"""
+        with self._lock:
+            stages = {
+                stage: {
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'avg_ms': total * 1000 / count,
+                    'max_ms': max_seconds * 1000,
+                    'per_message_ms': total * 1000 / self._messages if self._messages else None
+                }
+                for stage, (count, total, max_seconds) in sorted(
+                    self._stages.items(), key=lambda item: item[1][1], reverse=True
+                )
+            }
+            return {
+                'sample_rate': self.sample_rate,
+                'sampled_runs': self._runs,
+                'sampled_messages': self._messages,
+                'stages': stages
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages = {}
+            self._runs = 0
+            self._messages = 0
+
+    def capture_cprofile(self, seconds: float, limit: int = 50) -> Optional[str]:
+        """
+        включает cProfile во всех воркерах на seconds секунд и возвращает
+        объединённую статистику (топ limit функций по cumulative) текстом.
+        Если снимок уже снимается другим запросом - None.
+        """
+        if not self._capture_lock.acquire(blocking=False):
+            return None
+        try:
+            with self._lock:
+                self._capture_profiles = []
+                self._capture_until = time.monotonic() + seconds
+            time.sleep(seconds)
+            with self._lock:
+                self._capture_until = None
+            # даём воркерам доработать текущий run() и выключить профайлер
+            time.sleep(min(seconds, 5.0))
+            with self._lock:
+                profiles = self._capture_profiles
+                self._capture_profiles = []
+
+            out = io.StringIO()
+            if not profiles:
+                out.write('no processor runs during capture\n')
+                return out.getvalue()
+            stats = pstats.Stats(profiles[0], stream=out)
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.sort_stats('cumulative').print_stats(limit)
+            return out.getvalue()
+        finally:
+            self._capture_lock.release()
+
+    def _thread_profile(self) -> Optional[cProfile.Profile]:
+        """cProfile текущего потока, пока идёт снимок (cProfile видит только свой поток)"""
+        with self._lock:
+            if self._capture_until is None or time.monotonic() >= self._capture_until:
+                self._local.profile = None
+                return None
+            profile = getattr(self._local, 'profile', None)
+            if profile is None or profile not in self._capture_profiles:
+                profile = cProfile.Profile()
+                self._capture_profiles.append(profile)
+                self._local.profile = profile
+            return profile
+
+
+# общий профайлер процесса сервиса
+profiler = StageProfiler()
@@ -1,18 +1,54 @@
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, Optional
 
 import psycopg
 from psycopg import Connection
+from psycopg_pool import ConnectionPool
 
 
 class PgConnect:
-    def __init__(self, host: str, port: int, db_name: str, user: str, pw: str, sslmode: str = "require") -> None:
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db_name: str,
+                 user: str,
+                 pw: str,
+                 sslmode: str = "require",
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 0,
+                 pool_max_idle: float = 300.0,
+                 pool_max_lifetime: float = 3600.0,
+                 prepare_threshold: Optional[int] = 5
+                 ) -> None:
         self.host = host
         self.port = port
         self.db_name = db_name
         self.user = user
         self.pw = pw
         self.sslmode = sslmode
+        # через сколько выполнений одного и того же запроса psycopg готовит
+        # server-side prepared statement на подключении (0 - сразу, None - никогда).
+        # Имеет смысл вместе с пулом: подготовленный запрос живёт, пока живёт подключение.
+        self.prepare_threshold = prepare_threshold
+
+        # pool_max_size > 0 включает пул долгоживущих подключений:
+        # TCP+TLS+auth handshake делается один раз на подключение, а не на каждый `with`.
+        # Подключения проверяются перед выдачей (check), лишние сверх pool_min_size
+        # закрываются после pool_max_idle секунд простоя, а любое подключение
+        # пересоздаётся после pool_max_lifetime секунд жизни.
+        self._pool: Optional[ConnectionPool] = None
+        if pool_max_size > 0:
+            self._pool = ConnectionPool(
+                self.url(),
+                min_size=min(pool_min_size, pool_max_size),
+                max_size=pool_max_size,
+                max_idle=pool_max_idle,
+                max_lifetime=pool_max_lifetime,
+                kwargs={'prepare_threshold': self.prepare_threshold},
+                check=ConnectionPool.check_connection,
+                name=f'{self.host}:{self.port}/{self.db_name}',
+                open=True
+            )
 
     def url(self) -> str:
         return """
@@ -33,7 +69,14 @@ class PgConnect:
 
     @contextmanager
     def connection(self) -> Generator[Connection, None, None]:
-        conn = psycopg.connect(self.url())
+        if self._pool is not None:
+            # пул сам делает commit на выходе (rollback при исключении)
+            # и возвращает подключение в пул вместо закрытия
+            with self._pool.connection() as conn:
+                yield conn
+            return
+
+        conn = psycopg.connect(self.url(), prepare_threshold=self.prepare_threshold)
         try:
             yield conn
             conn.commit()
@@ -42,3 +85,7 @@ class PgConnect:
             raise e
         finally:
             conn.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
@@ -1 +1,2 @@
 from .redis_client import RedisClient  # noqa
+from .redis_cache import RedisCache  # noqa
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from .redis_client import RedisClient
+
+
+class RedisCache:
+    """
+    read-through кэш в памяти процесса поверх RedisClient.
+    LRU с ограничением по количеству ключей (max_size) и временем жизни записи (ttl, секунды).
+    Когда запись протухла по ttl, документ перечитывается из Redis, но если его
+    update_ts_utc не изменился (или пришёл более старый), в кэше остаётся прежний объект -
+    так потребители могут по identity/версии понять, что документ не менялся.
+    Отсутствующие в Redis ключи не кэшируются.
+    """
+
+    def __init__(self, client: RedisClient, max_size: int = 1000, ttl: float = 60.0) -> None:
+        self._client = client
+        self._max_size = max_size
+        self._ttl = ttl
+        # k -> (expires_at, obj); порядок - от давно использованных к недавним
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def set(self, k, v) -> None:
+        self._client.set(k, v)
+        self._entries.pop(k, None)
+
+    def get(self, k) -> Optional[Dict]:
+        now = time.monotonic()
+        entry = self._entries.get(k)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(k)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        obj = self._client.get(k)
+        return self._store(k, obj, entry, now)
+
+    def mget(self, keys: Iterable) -> Dict[Any, Optional[Dict]]:
+        """
+        пакетное чтение: свежие записи берутся из кэша,
+        все промахи дочитываются из Redis одним MGET.
+        """
+        now = time.monotonic()
+        result = {}
+        missed = []
+        for k in dict.fromkeys(keys):
+            entry = self._entries.get(k)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(k)
+                self.hits += 1
+                result[k] = entry[1]
+            else:
+                self.misses += 1
+                missed.append(k)
+
+        if missed:
+            for k, obj in self._client.mget(missed).items():
+                result[k] = self._store(k, obj, self._entries.get(k), now)
+        return result
+
+    def _store(self, k, obj: Optional[Dict], entry: Optional[tuple], now: float) -> Optional[Dict]:
+        if obj is None:
+            self._entries.pop(k, None)
+            return None
+
+        if entry is not None and not self._is_newer(obj, entry[1]):
+            # документ в Redis не менялся - продлеваем жизнь старому объекту
+            obj = entry[1]
+
+        self._entries[k] = (now + self._ttl, obj)
+        self._entries.move_to_end(k)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return obj
+
+    @staticmethod
+    def _is_newer(obj: Dict, cached: Dict) -> bool:
+        obj_ts = obj.get('update_ts_utc')
+        cached_ts = cached.get('update_ts_utc')
+        if obj_ts is None or cached_ts is None:
+            return True
+        # update_ts_utc - строка в ISO-формате, сравнивается лексикографически
+        return str(obj_ts) > str(cached_ts)
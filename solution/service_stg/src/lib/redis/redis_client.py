@@ -1,8 +1,9 @@
-import json
-from typing import Dict
+from typing import Any, Dict, Iterable, Optional
 
 import redis
 
+from lib.codec import json_codec
+
 
 class RedisClient:
     def __init__(self, host: str, port: int, password: str, cert_path: str) -> None:
@@ -14,11 +15,25 @@ class RedisClient:
             ssl_ca_certs=cert_path)
 
     def set(self, k, v):
-        self._client.set(k, json.dumps(v))
+        self._client.set(k, json_codec.dumps(v))
 
     def get(self, k) -> Dict:
-        obj: str = self._client.get(k)  # type: ignore
+        obj: bytes = self._client.get(k)  # type: ignore
         if obj is None:
             return None
         else:
-            return json.loads(obj)
+            return json_codec.loads(obj)
+
+    def mget(self, keys: Iterable) -> Dict[Any, Optional[Dict]]:
+        """
+        пакетное чтение: все ключи одним MGET за один round-trip.
+        на выходе - dict ключ -> документ (None, если ключа в Redis нет).
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        if not unique_keys:
+            return {}
+        objs = self._client.mget(unique_keys)
+        return {
+            k: (None if obj is None else json_codec.loads(obj))
+            for k, obj in zip(unique_keys, objs)
+        }
@@ -0,0 +1,36 @@
+from collections import OrderedDict
+from typing import Dict
+
+
+class MenuCategoryIndex:
+    """
+    индекс блюдо-категория (product_id -> category) по каждому ресторану.
+    Индекс ресторана строится по полю "menu" один раз и пересобирается только тогда,
+    когда документ ресторана поменялся: пришёл другой объект с другим update_ts_utc.
+    Количество ресторанов в индексе ограничено max_size, вытесняются давно не использованные.
+    """
+
+    def __init__(self, max_size: int = 1000) -> None:
+        self._max_size = max_size
+        # restaurant_id -> (restaurant_data, update_ts_utc, {product_id: category})
+        self._indexes: OrderedDict = OrderedDict()
+
+    def categories(self, restaurant_id: str, restaurant_data: Dict) -> Dict[str, str]:
+        update_ts = restaurant_data.get('update_ts_utc')
+        entry = self._indexes.get(restaurant_id)
+        if entry is not None and (
+            entry[0] is restaurant_data
+            or (update_ts is not None and entry[1] == update_ts)
+        ):
+            self._indexes.move_to_end(restaurant_id)
+            return entry[2]
+
+        index = {}
+        for next_item in restaurant_data['menu']:
+            index[next_item['_id']] = next_item['category']
+
+        self._indexes[restaurant_id] = (restaurant_data, update_ts, index)
+        self._indexes.move_to_end(restaurant_id)
+        while len(self._indexes) > self._max_size:
+            self._indexes.popitem(last=False)
+        return index
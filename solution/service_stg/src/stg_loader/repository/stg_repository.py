@@ -1,4 +1,4 @@
-from datetime import datetime
+from typing import Dict, List
 
 from lib.pg import PgConnect
 
@@ -7,34 +7,44 @@ class StgRepository:
     def __init__(self, db: PgConnect) -> None:
         self._db = db
 
-    def order_events_insert(self,
-                            object_id: int,
-                            object_type: str,
-                            sent_dttm: datetime,
-                            payload: str
-                            ) -> None:
+    def order_events_insert_batch(self, order_events: List[Dict]) -> None:
+        """
+        upsert пачки событий в stg.order_events одним INSERT ... SELECT FROM unnest(...) ON CONFLICT.
+        Текст запроса не зависит от размера пачки, так что prepared statement на подключении один.
+        на входе - list of dicts; ключи в каждом словаре:
+        "object_id", "object_type", "sent_dttm", "payload" (payload - уже строка с json).
+        """
+
+        # ON CONFLICT DO UPDATE не может дважды обновить одну строку в одном запросе,
+        # поэтому дедуплицируем по object_id - последнее событие в пачке побеждает
+        dedup_events = {}
+        for next_event in order_events:
+            dedup_events[next_event['object_id']] = next_event
+        rows = list(dedup_events.values())
+        if not rows:
+            return
+
         upsert_statement = """
             INSERT INTO stg.order_events
                 (object_id, object_type, sent_dttm, payload)
-            VALUES
-                (
-                     {upsert_object_id},
-                    '{upsert_object_type}',
-                    '{upsert_sent_dttm}',
-                    '{upsert_payload}'
-                )
+            SELECT
+                "u"."object_id", "u"."object_type", "u"."sent_dttm", "u"."payload"
+            FROM unnest(
+                %(object_ids)s::int[], %(object_types)s::varchar[], %(sent_dttms)s::timestamp[], %(payloads)s::json[]
+            ) AS "u" ("object_id", "object_type", "sent_dttm", "payload")
             ON CONFLICT (object_id) DO UPDATE
             SET
                 object_type = EXCLUDED.object_type,
                 sent_dttm = EXCLUDED.sent_dttm,
                 payload = EXCLUDED.payload
             ;
-        """.format(
-            upsert_object_id=object_id,
-            upsert_object_type=object_type,
-            upsert_sent_dttm=sent_dttm,
-            upsert_payload=payload
-        )
+        """
+        params = {
+            'object_ids': [next_event['object_id'] for next_event in rows],
+            'object_types': [next_event['object_type'] for next_event in rows],
+            'sent_dttms': [next_event['sent_dttm'] for next_event in rows],
+            'payloads': [next_event['payload'] for next_event in rows]
+        }
         with self._db.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(upsert_statement)
\ No newline at end of file
+                cur.execute(upsert_statement, params)
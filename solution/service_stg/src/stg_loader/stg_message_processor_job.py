@@ -1,124 +1,194 @@
-import json
 import sys
 
 import time
 from datetime import datetime
 from logging import Logger
+from typing import Dict, List, Union
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
-from lib.redis import RedisClient
+import psycopg
+import redis
+from confluent_kafka import KafkaException
+
+from lib.codec import json_codec
+from lib.kafka_connect import BatchRetry, KafkaConsumer, KafkaDeliveryError, KafkaMessage, KafkaProducer, LagMonitor
+from lib.metrics import processor_metrics
+from lib.redis import RedisCache, RedisClient
+from stg_loader.menu_category_index import MenuCategoryIndex
 from stg_loader.repository.stg_repository import StgRepository
 
+# недоступность PG, Redis или Kafka: такие пачки повторяем, пока не получится, а не пропускаем
+_TRANSIENT_ERRORS = (
+    psycopg.OperationalError,
+    redis.exceptions.ConnectionError,
+    redis.exceptions.TimeoutError,
+    KafkaDeliveryError,
+    KafkaException
+)
+
 
 class StgMessageProcessor:
     _consumer: KafkaConsumer = None
     _producer: KafkaProducer = None
-    _redis: RedisClient = None
+    _redis: Union[RedisClient, RedisCache] = None
     _stg_repository: StgRepository = None
-    _batch_size: int = 100
+    _menu_index: MenuCategoryIndex = None
+    _lag_monitor: LagMonitor = None
+    _batch_retry: BatchRetry = None
     _logger: Logger = None
 
     def __init__(
                     self,
                     kafka_consumer: KafkaConsumer,
                     kafka_producer: KafkaProducer,
-                    redis_client: RedisClient,
+                    redis_client: Union[RedisClient, RedisCache],
                     stg_repository: StgRepository,
-                    batch_size: int,
+                    lag_monitor: LagMonitor,
                     logger: Logger
                 ) -> None:
         self._consumer = kafka_consumer
         self._producer = kafka_producer
         self._redis = redis_client
         self._stg_repository = stg_repository
-        self._batch_size = batch_size
+        self._menu_index = MenuCategoryIndex()
+        self._lag_monitor = lag_monitor
+        self._batch_retry = BatchRetry(kafka_consumer, logger, transient_errors=_TRANSIENT_ERRORS)
         self._logger = logger
 
-    # функция, которая будет вызываться по расписанию.
-    def run(self) -> None:
+    # функция, которую ProcessorRunner вызывает в цикле.
+    # Возвращает количество обработанных сообщений (0 - в Kafka пусто).
+    def run(self) -> int:
+        # 1. Получите пачку сообщений из Kafka с помощью `consume_batch`.
+        # размер пачки и таймаут опроса - по отставанию консьюмера
+        if self._lag_monitor.update():
+            processor_metrics.consumer_lag(self._lag_monitor.lag)
+        # время опроса Kafka (kafka_poll) и декодирования (kafka_decode) замеряет сам consume_batch
+        messages = self._consumer.consume_batch(
+            self._lag_monitor.batch_size(),
+            timeout=self._lag_monitor.poll_timeout()
+        )
+        if not messages:
+            # если в Kafka сообщений нет
+            return 0
+
         # Пишем в лог, что джоб был запущен.
-        self._logger.info(f"{datetime.utcnow()}: START")
-
-        processed_messages = 0;
-        timeout: float = 3.0
-        while processed_messages < self._batch_size:
-            # 1. Получите сообщение из Kafka с помощью `consume`.
-            dct_msg = self._consumer.consume(timeout=timeout)
-
-            if dct_msg is None:
-                # если в Kafka сообщений нет
-                break
-            else:
-                # 2. Сохраните сообщение в таблицу, используя `_stg_repository`.
-                self._stg_repository.order_events_insert(
-                    dct_msg['object_id'],
-                    dct_msg['object_type'],
-                    dct_msg['sent_dttm'],
-                    json.dumps(dct_msg['payload'])
-                )
-                # 3. Достаньте `id пользователя` из сообщения
-                # и получите полную информацию о пользователе из Redis.
-                user_id = dct_msg['payload']['user']['id']
-                user_data = self._redis.get(user_id)  # _id, name, login, update_ts_utc
-                # 4. Достаньте `id ресторана` из сообщения
-                # и получите полную информацию о ресторане из Redis.
-                restaurant_id = dct_msg['payload']['restaurant']['id']
-                restaurant_data = self._redis.get(restaurant_id)
-                # сформируем словарь блюдо-категория из поля "menu" ресторана
-                order_item_categories = {}
-                menu = restaurant_data['menu']
-                for next_item in menu:
-                    next_item_id = next_item['_id']
-                    next_item_category = next_item['category']
-                    order_item_categories[next_item_id] = next_item_category
-                # 6. Для каждого `product_id` в сообщении:
-                #    1. достать `product_id`.
-                #    2. (нужна категория).
-                order_items_array = dct_msg['payload']['order_items']
-                # order_items: id, name, price, quantity
-                # NEED GET category from redis
-                products_array = []
-                for order_item in order_items_array:
-                    order_item_id = order_item['id']
-                    if order_item_id in order_item_categories:
-                        order_item_category = order_item_categories[order_item_id]
-                    else:
-                        order_item_category = ''
-                    products_array.append(
-                        {
-                            "id": order_item_id,
-                            "name": order_item['name'],
-                            "price": order_item['price'],
-                            "quantity": order_item['quantity'],
-                            "category": order_item_category
-                        }
-                    )
-                # 5. Сформируйте выходное сообщение.
-                msg = {
+        self._logger.info(f"{datetime.utcnow()}: START, {len(messages)} messages")
+
+        # если пачка не записалась, BatchRetry возвращает позицию чтения на её начало,
+        # чтобы следующий run() прочитал её заново, а не закоммитил оффсеты поверх;
+        # сообщения, которые падают при каждой попытке, после нескольких повторов пропускаются
+        self._batch_retry.process(messages, self._process_batch)
+
+        # 8. Пачка записана в PG и доставлена в Kafka - фиксируем оффсеты.
+        with processor_metrics.stage('kafka_commit'):
+            self._consumer.commit(messages)
+        processor_metrics.batch_done(len(messages))
+
+        # Пишем в лог, что джоб успешно завершен.
+        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        return len(messages)
+
+    def close(self) -> None:
+        self._consumer.close()
+
+    def lag(self) -> Dict[int, int]:
+        """последнее известное отставание консьюмера: партиция -> сообщений"""
+        return self._lag_monitor.lag
+
+    def _process_batch(self, messages: List[KafkaMessage]) -> None:
+        batch = [message.value for message in messages]
+
+        # 2. Сохраните сообщения в таблицу, используя `_stg_repository`:
+        # вся пачка пишется одним upsert-ом за один round-trip.
+        with processor_metrics.stage('pg_order_events_insert'):
+            self._stg_repository.order_events_insert_batch([
+                {
                     'object_id': dct_msg['object_id'],
                     'object_type': dct_msg['object_type'],
-                    'payload': {
-                        'id': dct_msg['object_id'],
-                        'date': dct_msg['payload']['date'],
-                        'cost': dct_msg['payload']['cost'],
-                        'payment': dct_msg['payload']['payment'],
-                        'status': dct_msg['payload']['final_status'],
-                        "restaurant": {
-                            "id": restaurant_id,
-                            "name": restaurant_data['name']
-                        },
-                        "user": {
-                            "id": user_id,
-                            "name": user_data['name'],
-                            "login": user_data['login']
-                        },
-                        "products": products_array
+                    'sent_dttm': dct_msg['sent_dttm'],
+                    'payload': json_codec.dumps_str(dct_msg['payload'])
+                }
+                for dct_msg in batch
+            ])
+
+        # 3-4. Соберите `id пользователей` и `id ресторанов` всей пачки
+        # и получите полную информацию о них из Redis одним пакетным запросом.
+        redis_keys = []
+        for dct_msg in batch:
+            redis_keys.append(dct_msg['payload']['user']['id'])
+            redis_keys.append(dct_msg['payload']['restaurant']['id'])
+        with processor_metrics.stage('redis_get'):
+            redis_docs = self._redis.mget(redis_keys)
+
+        # выходные сообщения собираем целиком до отправки: если обогащение упадёт на середине,
+        # в Kafka не уйдёт ни одного сообщения пачки, и после rewind дублей не будет
+        out_messages = []
+        for dct_msg in batch:
+            user_id = dct_msg['payload']['user']['id']
+            user_data = redis_docs[user_id]  # _id, name, login, update_ts_utc
+            restaurant_id = dct_msg['payload']['restaurant']['id']
+            restaurant_data = redis_docs[restaurant_id]
+            if user_data is None or restaurant_data is None:
+                # без пользователя или ресторана заказ не обогатить - пропускаем его, а не всю пачку
+                missing = [k for k, doc in ((user_id, user_data), (restaurant_id, restaurant_data)) if doc is None]
+                self._logger.warning(
+                    f"{datetime.utcnow()}: order {dct_msg['object_id']} skipped, no redis documents for {missing}"
+                )
+                processor_metrics.message_skipped()
+                continue
+            # словарь блюдо-категория из поля "menu" ресторана берём из индекса,
+            # он пересобирается только при изменении документа ресторана
+            with processor_metrics.stage('menu_mapping'):
+                order_item_categories = self._menu_index.categories(restaurant_id, restaurant_data)
+            # 6. Для каждого `product_id` в сообщении:
+            #    1. достать `product_id`.
+            #    2. (нужна категория).
+            order_items_array = dct_msg['payload']['order_items']
+            # order_items: id, name, price, quantity
+            # NEED GET category from redis
+            products_array = []
+            for order_item in order_items_array:
+                order_item_id = order_item['id']
+                order_item_category = order_item_categories.get(order_item_id, '')
+                products_array.append(
+                    {
+                        "id": order_item_id,
+                        "name": order_item['name'],
+                        "price": order_item['price'],
+                        "quantity": order_item['quantity'],
+                        "category": order_item_category
                     }
+                )
+            # 5. Сформируйте выходное сообщение.
+            msg = {
+                'object_id': dct_msg['object_id'],
+                'object_type': dct_msg['object_type'],
+                'payload': {
+                    'id': dct_msg['object_id'],
+                    'date': dct_msg['payload']['date'],
+                    'cost': dct_msg['payload']['cost'],
+                    'payment': dct_msg['payload']['payment'],
+                    'status': dct_msg['payload']['final_status'],
+                    "restaurant": {
+                        "id": restaurant_id,
+                        "name": restaurant_data['name']
+                    },
+                    "user": {
+                        "id": user_id,
+                        "name": user_data['name'],
+                        "login": user_data['login']
+                    },
+                    "products": products_array
                 }
-                # 6. Отправьте выходное сообщение в `producer`.
-                self._producer.produce(msg)
+            }
+            out_messages.append(msg)
 
-            processed_messages += 1
+        # 6. Отправьте выходные сообщения в `producer`.
+        # ключ - id пользователя: все его заказы попадают в одну партицию и к одному воркеру dds
+        with processor_metrics.stage('kafka_produce'):
+            for msg in out_messages:
+                self._producer.produce(msg, key=msg['payload']['user']['id'])
 
-        # Пишем в лог, что джоб успешно завершен.
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        # 7. Дождитесь подтверждения доставки всех сообщений пачки разом.
+        # Недоставленные сообщения всплывают здесь как KafkaDeliveryError.
+        with processor_metrics.stage('kafka_flush'):
+            self._producer.flush()